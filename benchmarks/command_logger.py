@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import inspect
+import os
+import shutil
+import sys
+import tempfile
+import time
+from functools import wraps
+from types import SimpleNamespace
+
+# Time command_logger adds to every command. Runs a command that answers right away through
+# the logger, through the previous logger that waited 100 ms and fetched the original response
+# (with a simulated request latency), and without any logger, and reports the time each logger
+# adds per command.
+#
+#   python benchmarks/command_logger.py [--commands 2000] [--request-latency 0.05]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVER_ID = 1
+
+class FakeInteraction:
+    def __init__(self, request_latency):
+        self.request_latency = request_latency
+        self.sent = None
+        self.response = SimpleNamespace(is_done=lambda: self.sent is not None)
+
+    async def original_response(self):
+        await asyncio.sleep(self.request_latency)
+        return SimpleNamespace(content=self.sent, embeds=[])
+
+class FakeContext:
+    def __init__(self, request_latency):
+        self.command = SimpleNamespace(name='dn')
+        self.guild = SimpleNamespace(id=SERVER_ID, name='guild')
+        self.author = SimpleNamespace(id=2, name='user')
+        self.channel = SimpleNamespace(id=3, name='channel')
+        self.interaction = FakeInteraction(request_latency)
+
+    async def respond(self, content=None, **kwargs):
+        self.interaction.sent = content
+
+def legacy_command_logger(func):
+    from core.logger import get_server_logger
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        ctx = next((arg for arg in args if hasattr(arg, 'command')), None)
+        logger = get_server_logger(ctx.guild.id)
+        sig = inspect.signature(func)
+        bound_args = sig.bind(*args, **kwargs)
+        bound_args.apply_defaults()
+        params = dict(bound_args.arguments)
+        params.pop('self', None)
+        params.pop('ctx', None)
+
+        result = await func(*args, **kwargs)
+        await asyncio.sleep(0.1)
+        if ctx.interaction.response.is_done():
+            response_message = await ctx.interaction.original_response()
+            response_content = response_message.content
+        else:
+            response_content = "No response sent"
+        logger.log_command(ctx, ctx.command.name, params, f"Success: {response_content}")
+        return result
+    return wrapper
+
+async def dn(self, ctx, input):
+    await ctx.respond(f"Found **{input}**", ephemeral=True)
+
+async def run(command, count, request_latency):
+    started_at = time.perf_counter()
+    for i in range(count):
+        await command(None, FakeContext(request_latency), input=f'B{i}')
+    return (time.perf_counter() - started_at) / count
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the time command_logger adds per command')
+    parser.add_argument('--commands', type=int, default=2000, help='commands to run through the current logger')
+    parser.add_argument('--request-latency', type=float, default=0.05, help='seconds per simulated Discord request')
+    args = parser.parse_args()
+
+    # The loggers write to data/<server_id> relative to the working directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        from core.logger import command_logger
+
+        bare = asyncio.run(run(dn, args.commands, args.request_latency))
+        current = asyncio.run(run(command_logger(dn), args.commands, args.request_latency))
+        # Every command waits over 100 ms, a few are enough
+        legacy = asyncio.run(run(legacy_command_logger(dn), 20, args.request_latency))
+
+        print(f'current logger  {(current - bare) * 1e6:10.1f} us per command')
+        print(f'previous logger {(legacy - bare) * 1e6:10.1f} us per command (100 ms wait and one request)')
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
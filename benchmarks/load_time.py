@@ -0,0 +1,79 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+# Load time of the CSV and binary database formats. Either generates a synthetic download
+# table or copies the databases of an existing server, then times loading it with both
+# backends.
+#
+#   python benchmarks/load_time.py [--entries 100000] [--server-dir data/<server_id>] [--runs 5]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.catalog import CatalogTable
+from core.snapshot import write_snapshot
+from core.storage import TABLES, BinaryStorage, CsvStorage
+
+def synthetic_rows(entries):
+    random.seed(0)
+    rows = []
+    for i in range(entries):
+        name = ''.join(random.choices(string.ascii_letters + ' ', k=random.randint(8, 40)))
+        links = {random.randint(10 ** 17, 10 ** 18): random.randint(10 ** 17, 10 ** 18) for _ in range(random.randint(1, 2))}
+        rows.append({'id': f'B{i}', 'name': name, 'links': links})
+    return rows
+
+def time_load(storage_class, server_dir, logger, runs):
+    timings = []
+    for _ in range(runs):
+        storage = storage_class(server_dir, logger)
+        started_at = time.perf_counter()
+        entries = sum(len(storage.load_table(table)) for table in TABLES)
+        timings.append(time.perf_counter() - started_at)
+        storage.close()
+    return entries, statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare database load times of the CSV and binary formats')
+    parser.add_argument('--entries', type=int, default=100000, help='synthetic download entries')
+    parser.add_argument('--server-dir', help='use the databases of this server directory instead')
+    parser.add_argument('--runs', type=int, default=5, help='loads per format, the median is reported')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('load_time')
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.server_dir:
+            for name in os.listdir(args.server_dir):
+                if name.endswith(('.csv', '.journal')):
+                    shutil.copy(os.path.join(args.server_dir, name), work_dir)
+        else:
+            CsvStorage(work_dir, logger)._write_snapshot('download', synthetic_rows(args.entries))
+
+        # Fold any journal into the CSV and write the matching binary snapshots
+        csv_storage = CsvStorage(work_dir, logger)
+        binary = BinaryStorage(work_dir, logger)
+        for table in TABLES:
+            write_snapshot(binary.snapshot_files[table], CatalogTable.from_rows(TABLES[table][1], csv_storage.load(table)))
+
+        entries, csv_time = time_load(CsvStorage, work_dir, logger, args.runs)
+        _, binary_time = time_load(BinaryStorage, work_dir, logger, args.runs)
+
+        for storage, suffix in (('CSV', '.csv'), ('binary', '.bin')):
+            size = sum(os.path.getsize(os.path.join(work_dir, name)) for name in os.listdir(work_dir) if name.endswith(suffix))
+            print(f'{storage:<7} {size / 1024 / 1024:8.1f} MB on disk')
+        print(f'CSV     {csv_time * 1000:8.1f} ms to load {entries} entries')
+        print(f'binary  {binary_time * 1000:8.1f} ms to load {entries} entries ({csv_time / binary_time:.1f}x faster)')
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
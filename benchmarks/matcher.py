@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+# Ingest matching cost per message. Parses a corpus of sample channel messages, mostly chatter
+# with some download and video posts, with the compiled matchers and with the previous
+# implementation that joined the content and embed texts and ran every regex on each message.
+# Both have to agree on every message.
+#
+#   python benchmarks/matcher.py [--messages 100000] [--post-rate 0.1] [--runs 5]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.matcher import DownloadMatcher, DEFAULT_SEARCH_REGEX
+from core.utils import embed_title, parse_download_message, parse_video_message
+
+CHATTER = [
+    'anyone know when the next one drops?',
+    'thanks!! :heart:',
+    'link is dead for me, can someone check',
+    'lol',
+    'https://example.com/some/article worth a read',
+    'check the pins <@&123456789012345678>',
+]
+
+def legacy_parse_download(message, search_regex):
+    content_to_check = message.content
+    if message.embeds:
+        for embed in message.embeds:
+            if embed.description:
+                content_to_check += "\n" + embed.description
+
+    match = re.search(search_regex, content_to_check)
+    if match:
+        id = match.group(1)
+        download_match = re.search(r'Link : (https?://\S+)', content_to_check)
+        if download_match:
+            return id, embed_title(message)
+    return None
+
+def legacy_parse_video(message):
+    content_to_check = message.content
+    video_url = None
+    video_title = None
+
+    if message.embeds:
+        for embed in message.embeds:
+            if embed.type == 'video' and embed.url:
+                video_url = embed.url
+                video_title = embed.title
+            elif embed.type == 'rich' and embed.url and ('youtube.com' in embed.url or 'youtu.be' in embed.url):
+                video_url = embed.url
+                video_title = embed.title
+
+            if embed.description:
+                content_to_check += "\n" + embed.description
+            if embed.fields:
+                for field in embed.fields:
+                    content_to_check += f"\n{field.name}: {field.value}"
+
+            if video_url and video_title:
+                break
+
+    if not video_url:
+        youtube_link = re.search(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})', content_to_check)
+        if youtube_link:
+            video_id = youtube_link.group(6)
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+
+    tag_match = re.search(r'<@&(\d+)>', content_to_check)
+    tag = tag_match.group(0) if tag_match else ""
+
+    if video_url:
+        return video_title or embed_title(message), tag, video_url
+    return None
+
+def embed(title=None, description=None, type='rich', url=None, fields=()):
+    return SimpleNamespace(title=title, description=description, type=type, url=url, fields=list(fields))
+
+def sample_messages(count, post_rate):
+    random.seed(0)
+    messages = []
+    for i in range(count):
+        roll = random.random()
+        if roll < post_rate / 2:
+            content = f'DN : B{i}\nLink : https://example.com/{i}'
+            embeds = [embed(title=f'Title {i}', description='A long description of the download ' * 5)]
+        elif roll < post_rate:
+            video_id = f'{i:011d}'
+            content = f'New video <@&42> https://youtu.be/{video_id}'
+            embeds = [embed(title=f'Video {i}', type='video', url=f'https://www.youtube.com/watch?v={video_id}')]
+        else:
+            content = random.choice(CHATTER)
+            embeds = [embed(title='Preview', description='Some page description ' * 10)] if random.random() < 0.2 else []
+        messages.append(SimpleNamespace(id=i, content=content, embeds=embeds))
+    return messages
+
+def best_time(func, messages, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        for message in messages:
+            func(message)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compiled ingest matchers with per-message regex searches')
+    parser.add_argument('--messages', type=int, default=100000, help='messages in the sample corpus')
+    parser.add_argument('--post-rate', type=float, default=0.1, help='share of messages that are download or video posts')
+    parser.add_argument('--runs', type=int, default=5, help='passes over the corpus, the fastest is reported')
+    args = parser.parse_args()
+
+    messages = sample_messages(args.messages, args.post_rate)
+    matcher = DownloadMatcher(DEFAULT_SEARCH_REGEX)
+
+    for message in messages:
+        assert parse_download_message(message, matcher) == legacy_parse_download(message, DEFAULT_SEARCH_REGEX), message
+        assert parse_video_message(message) == legacy_parse_video(message), message
+
+    cases = (
+        ('download', lambda message: legacy_parse_download(message, DEFAULT_SEARCH_REGEX), lambda message: parse_download_message(message, matcher)),
+        ('video', legacy_parse_video, parse_video_message),
+    )
+    for label, legacy, compiled in cases:
+        legacy_time = best_time(legacy, messages, args.runs)
+        compiled_time = best_time(compiled, messages, args.runs)
+        print(f'{label:<9} per message {legacy_time / len(messages) * 1e6:6.2f} us -> {compiled_time / len(messages) * 1e6:6.2f} us ({legacy_time / compiled_time:.1f}x faster)')
+
+if __name__ == '__main__':
+    main()
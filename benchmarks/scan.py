@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Channel scan throughput. Scans a synthetic channel, with a delay per history request to
+# stand in for the Discord API, once message by message with a write per post and once
+# through the scan pipeline, and reports messages per second for both.
+#
+#   python benchmarks/scan.py [--messages 50000] [--page-latency 0.05] [--hit-rate 0.5]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVER_ID = 1
+CHANNEL_ID = 2
+
+class FakeChannel:
+    def __init__(self, messages, page_latency):
+        self.id = CHANNEL_ID
+        self.name = 'downloads'
+        self.messages = messages
+        self.page_latency = page_latency
+
+    async def history(self, limit=None, after=None, oldest_first=None):
+        start = 0
+        if after is not None:
+            start = next((i for i, message in enumerate(self.messages) if message.id > after.id), len(self.messages))
+        for i in range(start, len(self.messages)):
+            # One request per 100 messages, like channel.history
+            if (i - start) % 100 == 0:
+                await asyncio.sleep(self.page_latency)
+            yield self.messages[i]
+
+def synthetic_messages(count, hit_rate):
+    random.seed(0)
+    guild = SimpleNamespace(id=SERVER_ID)
+    channel = SimpleNamespace(id=CHANNEL_ID, name='downloads')
+    messages = []
+    for i in range(count):
+        if random.random() < hit_rate:
+            content = f'DN : B{random.randint(0, count // 2)}\nLink : https://example.com/{i}'
+            embeds = [SimpleNamespace(title=f'Title {i}', description=None, type='rich', url=None, fields=[])]
+        else:
+            content = 'just chatting'
+            embeds = []
+        messages.append(SimpleNamespace(id=10 ** 17 + i, guild=guild, channel=channel, content=content, embeds=embeds))
+    return messages
+
+async def per_message(channel):
+    from core.database import get_server_database_async
+    from core.matcher import get_download_matcher
+    from core.utils import parse_download_message
+
+    started_at = time.perf_counter()
+    db = await get_server_database_async(SERVER_ID)
+    matcher = get_download_matcher(SERVER_ID)
+    async for message in channel.history(limit=None):
+        parsed = parse_download_message(message, matcher)
+        if parsed:
+            # One write per post, stored before the next message is read
+            id, name = parsed
+            await db.aio.update_download_database(id, name, message.channel.id, message.id)
+            await db.aio.flush()
+    return time.perf_counter() - started_at
+
+async def pipeline(channel):
+    from core.checkpoints import get_scan_checkpoints
+    from core.utils import scan_channel_history
+
+    get_scan_checkpoints(SERVER_ID).reset('download')
+    _, _, elapsed = await scan_channel_history(SERVER_ID, 'download', channel)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare message by message scanning with the scan pipeline')
+    parser.add_argument('--messages', type=int, default=50000, help='messages in the synthetic channel')
+    parser.add_argument('--page-latency', type=float, default=0.05, help='seconds per history request of 100 messages')
+    parser.add_argument('--hit-rate', type=float, default=0.5, help='share of messages that are download posts')
+    args = parser.parse_args()
+
+    # The bot keeps its data relative to the working directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        from core.database import flush_all_databases
+
+        channel = FakeChannel(synthetic_messages(args.messages, args.hit_rate), args.page_latency)
+        for label, scan in (('per message', per_message), ('pipeline', pipeline)):
+            elapsed = asyncio.run(scan(channel))
+            flush_all_databases()
+            print(f'{label:<12} {elapsed:8.2f}s  {args.messages / elapsed:10.0f} msgs/sec')
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
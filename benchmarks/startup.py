@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup benchmark. Measures the import time of everything bot.py loads with
+# `python -X importtime`, and with --ready the time until the bot reports on_ready
+# (needs BOT_TOKEN in the environment or .env). Results are checked against
+# startup_budget.json and the script exits with 1 when a budget is exceeded.
+#
+#   python benchmarks/startup.py [--runs 5] [--ready]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+READY_LINE = re.compile(r'Ready after ([\d.]+)s')
+
+def bot_modules():
+    # The modules bot.py imports or loads as extensions, commented out extensions are skipped
+    with open(os.path.join(ROOT, 'bot.py'), encoding='utf-8') as f:
+        source = f.read()
+    extensions = re.findall(r"^\s*bot\.load_extension\('([\w.]+)'\)", source, re.MULTILINE)
+    return ['discord', 'dotenv', 'core.database'] + extensions
+
+def measure_imports(modules):
+    code = '; '.join(f'import {module}' for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total = 0
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        # Top level entries add up to the whole import time
+        if not indent:
+            total += cumulative
+        modules[name] = cumulative
+    return total / 1000, modules
+
+def measure_ready(timeout):
+    process = subprocess.Popen([sys.executable, '-u', 'bot.py'], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.monotonic() + timeout
+    try:
+        for line in process.stdout:
+            match = READY_LINE.search(line)
+            if match:
+                return float(match.group(1))
+            if time.monotonic() > deadline:
+                break
+        raise RuntimeError(f'bot did not report ready within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure bot startup time against the tracked budget')
+    parser.add_argument('--runs', type=int, default=5, help='import time runs, the median is reported')
+    parser.add_argument('--ready', action='store_true', help='also start the bot and measure the time to on_ready')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for on_ready')
+    args = parser.parse_args()
+
+    with open(BUDGET_FILE, encoding='utf-8') as f:
+        budget = json.load(f)
+
+    modules = bot_modules()
+    runs = [measure_imports(modules) for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _ in runs)
+    slowest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)
+
+    print(f'Import time: {import_ms:.0f} ms (budget {budget["import_ms"]} ms, median of {args.runs} runs)')
+    print('Project modules:')
+    for name, cumulative in slowest:
+        if name.split('.')[0] in ('core', 'cogs'):
+            print(f'  {name:<30} {cumulative / 1000:8.1f} ms')
+
+    over_budget = import_ms > budget['import_ms']
+
+    if args.ready:
+        ready_s = measure_ready(args.timeout)
+        print(f'Time to on_ready: {ready_s:.2f} s (budget {budget["ready_s"]} s)')
+        over_budget = over_budget or ready_s > budget['ready_s']
+
+    if over_budget:
+        print('Startup is over budget')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
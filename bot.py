@@ -1,28 +1,41 @@
+import time
+
+# Taken before anything else is imported, so the ready time includes the import time
+STARTED_AT = time.perf_counter()
+
 import discord
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-intents.presences = True
+from core.database import flush_all_databases
+
+# Search worker processes are spawned and import this module, they must not start the bot
+if __name__ == '__main__':
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+    intents.presences = True
+
+    bot = discord.Bot(intents=intents)
+    bot.started_at = STARTED_AT
+
+    # Load cogs
+    # Event listener
+    bot.load_extension('cogs.events')
 
-bot = discord.Bot(intents=intents)
+    # User command
+    bot.load_extension('cogs.downloadCommand')
+    bot.load_extension('cogs.videoCommand')
 
-# Load cogs
-# Event listener
-bot.load_extension('cogs.events')
+    # Moderator commands
+    bot.load_extension('cogs.logCommand')
+    bot.load_extension('cogs.configCommand')
+    bot.load_extension('cogs.helpCommand')
+    # bot.load_extension('cogs.creditCommand') -> TODO make nicer
 
-# User command
-bot.load_extension('cogs.downloadCommand')
-bot.load_extension('cogs.videoCommand')
+    bot.run(os.getenv('BOT_TOKEN'))
 
-# Moderator commands
-bot.load_extension('cogs.logCommand')
-bot.load_extension('cogs.configCommand')
-bot.load_extension('cogs.helpCommand')
-# bot.load_extension('cogs.creditCommand') -> TODO make nicer
- 
-bot.run(os.getenv('BOT_TOKEN'))
\ No newline at end of file
+    # Write out any database changes still waiting in the write scheduler
+    flush_all_databases()
@@ -2,10 +2,12 @@ import discord
 from discord.ext import commands
 from discord.commands import Option, SlashCommandGroup
 
+from core.checkpoints import get_scan_checkpoints
 from core.config import load_config, save_config
 from core.guards import is_admin, is_moderator
+from core.ingest import get_ingest
 from core.logger import command_logger
-from core.utils import scan_download_channel, scan_video_channel
+from core.scan_jobs import scan_scheduler, start_scans
 
 class ConfigCommand(commands.Cog):
     def __init__(self, bot):
@@ -17,33 +19,33 @@ class ConfigCommand(commands.Cog):
     # Cooldown command
     ########################################
 
-    @config.command(name="cooldown", description="Configure cooldown settings for the /download and /dn command")
+    @config.command(name="cooldown", description="Configure cooldown settings for the /download, /dn and /video commands")
     @is_admin()
     @command_logger
     async def config_cooldown(
         self,
         ctx,
         cooldown_limit: Option(int, "Set the cooldown limit", required=True),
-        cooldown_timeout: Option(int, "Set the cooldown timeout in seconds", required=True)
+        cooldown_timeout: Option(int, "Set the cooldown timeout in seconds", required=True),
+        shared: Option(bool, "Share one cooldown between /download, /dn and /video", required=False) = None
     ):
         server_id = ctx.guild.id
         config = load_config(server_id)
         
+        if shared is None:
+            shared = config.get('cooldown', {}).get('shared', False)
         config['cooldown'] = {
             'limit': cooldown_limit,
-            'timeout': cooldown_timeout
+            'timeout': cooldown_timeout,
+            'shared': shared
         }
         
+        # The cooldown service reads the new limits from the guild policy on the next command
         save_config(server_id, config)
 
         self.bot.dispatch('config_update')
         
-        # Update the cooldown for the DownloadCommand
-        download_cog = self.bot.get_cog('DownloadCommand')
-        if download_cog:
-            download_cog.config = config
-        
-        await ctx.respond(f"Cooldown configuration updated. Limit: {cooldown_limit}, Timeout: {cooldown_timeout} seconds", ephemeral=True)
+        await ctx.respond(f"Cooldown configuration updated. Limit: {cooldown_limit}, Timeout: {cooldown_timeout} seconds, Shared: {'yes' if shared else 'no'}", ephemeral=True)
 
 
     ########################################
@@ -224,16 +226,18 @@ class ConfigCommand(commands.Cog):
         elif action == "scan":
             if channel:
                 await ctx.respond(f"🔍 Scanning video channel **{channel}**", ephemeral=True)
-                await scan_video_channel(ctx, channel)
+                await start_scans(ctx, 'video', [channel])
             else:
                 await ctx.respond("🔍 Scanning all configured video channels...", ephemeral=True)
+                channels = []
                 for channel_id, channel_name in config['video_channels'].items():
-                    channel = discord.utils.get(ctx.guild.channels, name=channel_name)
+                    channel = ctx.guild.get_channel(int(channel_id))
                     if channel:
-                        await scan_video_channel(ctx, channel)
+                        channels.append(channel)
                     else:
                         await ctx.followup.send(f"❌ Could not find channel: **{channel_name}**", ephemeral=True)
-                await ctx.followup.send("✅ Scan completed for all configured video channels.", ephemeral=True)
+                if channels:
+                    await start_scans(ctx, 'video', channels)
 
         elif action == "list":
             if 'video_channels' not in config or not config['video_channels']:
@@ -293,16 +297,18 @@ class ConfigCommand(commands.Cog):
         elif action == "scan":
             if channel:
                 await ctx.respond(f"🔍 Scanning channel **{channel}**", ephemeral=True)
-                await scan_download_channel(ctx, channel)
+                await start_scans(ctx, 'download', [channel])
             else:
                 await ctx.respond("🔍 Scanning all configured channels...", ephemeral=True)
+                channels = []
                 for channel_id, channel_name in config['download_channels'].items():
-                    channel = discord.utils.get(ctx.guild.channels, name=channel_name)
+                    channel = ctx.guild.get_channel(int(channel_id))
                     if channel:
-                        await scan_download_channel(ctx, channel)
+                        channels.append(channel)
                     else:
                         await ctx.followup.send(f"❌ Could not find channel: **{channel_name}**", ephemeral=True)
-                await ctx.followup.send("✅ Scan completed for all configured channels.", ephemeral=True)
+                if channels:
+                    await start_scans(ctx, 'download', channels)
 
         elif action == "list":
             if 'download_channels' not in config or not config['download_channels']:
@@ -318,6 +324,40 @@ class ConfigCommand(commands.Cog):
             await ctx.respond("Invalid action. Please choose 'add', 'remove', 'scan', or 'list'.", ephemeral=True)
 
 
+    ########################################
+    # Running scans
+    ########################################
+
+    @config.command(name="scan", description="Show or cancel the running and queued channel scans")
+    @is_moderator()
+    @command_logger
+    async def config_scan(
+        self,
+        ctx,
+        action: Option(str, "Choose an action", choices=["status", "cancel"]),
+        channel: Option(discord.TextChannel, "Only cancel the scan of this channel", required=False) = None
+    ):
+        server_id = ctx.guild.id
+
+        if action == "status":
+            jobs = scan_scheduler.jobs(server_id)
+            embed = discord.Embed(title=f"🔍 Channel Scans", color=discord.Color.blue())
+            embed.description = "\n".join(job.describe() for job in jobs) if jobs else "No scans are running or queued."
+            embed.add_field(name="Live ingest", value=get_ingest(server_id).stats(), inline=False)
+            await ctx.respond(embed=embed, ephemeral=True)
+
+        elif action == "cancel":
+            cancelled = scan_scheduler.cancel(server_id, channel.id if channel else None)
+            if not cancelled:
+                await ctx.respond("There is no scan to cancel.", ephemeral=True)
+            else:
+                channels = ", ".join(f"<#{job.channel.id}>" for job in cancelled)
+                await ctx.respond(f"⏹️ Cancelled the scan of {channels}. Scanning again continues where it stopped.", ephemeral=True)
+
+        else:
+            await ctx.respond("Invalid action. Please choose 'status' or 'cancel'.", ephemeral=True)
+
+
     ########################################
     # Update/Reset search regex
     ########################################
@@ -335,6 +375,8 @@ class ConfigCommand(commands.Cog):
         
         config['search_regex'] = regex
         save_config(server_id, config)
+        # Older posts can match the new regex, the next scan reads the download channels from the start
+        get_scan_checkpoints(server_id).reset('download')
 
         self.bot.dispatch('config_update')
         await ctx.respond(f"Search regex updated to: {regex}", ephemeral=True)
@@ -351,6 +393,8 @@ class ConfigCommand(commands.Cog):
         
         config['search_regex'] = 'DN : (.+)'
         save_config(server_id, config)
+        # Older posts can match the new regex, the next scan reads the download channels from the start
+        get_scan_checkpoints(server_id).reset('download')
 
         self.bot.dispatch('config_update')
         await ctx.respond(f"Search regex updated to: {'DN : (.+)'}", ephemeral=True)
@@ -1,58 +1,53 @@
+from core.catalog import jump_url
 from core.utils import truncate_with_dots
 import discord
 from discord.ext import commands
 from discord.commands import Option
-from discord.ext.commands import CooldownMapping, BucketType
 
+from core.autocomplete import autocomplete_cache, AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_NARROW_ITEMS
 from core.guards import is_not_ignored, in_allowed_channel
-from core.database import get_server_database
+from core.database import get_server_database_async, run_in_db_pool
 from core.logger import command_logger
-from core.config import load_config
+from core.cooldowns import check_cooldown
 
 class DownloadCommand(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.cooldown_mappings = {}
-
-    def get_cooldown_mapping(self, server_id):
-        if server_id not in self.cooldown_mappings:
-            config = load_config(server_id)
-            self.cooldown_mappings[server_id] = CooldownMapping.from_cooldown(
-                config.get('cooldown', {}).get('limit', 1),
-                config.get('cooldown', {}).get('timeout', 3),
-                BucketType.user
-            )
-        return self.cooldown_mappings[server_id]
-
-    async def check_cooldown(self, ctx):
-        server_id = ctx.guild.id
-        bucket = self.get_cooldown_mapping(server_id).get_bucket(ctx)
-        retry_after = bucket.update_rate_limit()
-        if retry_after:
-            raise commands.CommandOnCooldown(bucket, retry_after, BucketType.user)
-        return True
 
     async def download_id_autocomplete(self, ctx: discord.AutocompleteContext):
         server_id = ctx.interaction.guild_id
-        db = get_server_database(server_id)
         if not server_id:
             return []
-        return [truncate_with_dots(id, 100) for id in db.get_matching_download_ids(100, ctx.value)]
+        db = await get_server_database_async(server_id)
+        return await run_in_db_pool(
+            autocomplete_cache.lookup, db, ctx.interaction.user.id, 'download_id', ctx.value,
+            # One match past what the cache keeps tells it whether the result is complete
+            search=lambda query: db.get_download_id_rows(query, limit=AUTOCOMPLETE_NARROW_ITEMS + 1) if query else db.get_latest_download_rows(AUTOCOMPLETE_LIMIT),
+            label=lambda row: truncate_with_dots(db.get_download_id_at(row), 100),
+            narrow=lambda rows, query: db.get_download_id_rows(query, rows, AUTOCOMPLETE_NARROW_ITEMS + 1)
+        )
 
     async def download_name_autocomplete(self, ctx: discord.AutocompleteContext):
         server_id = ctx.interaction.guild_id
-        db = get_server_database(server_id)
         if not server_id:
             return []
-        return [truncate_with_dots(name, 100) for name in db.get_download_names(100, ctx.value, 0)]
+        db = await get_server_database_async(server_id)
+        return await run_in_db_pool(
+            autocomplete_cache.lookup, db, ctx.interaction.user.id, 'download_name', ctx.value,
+            search=lambda query: db.get_download_names(AUTOCOMPLETE_LIMIT, query, 0),
+            label=lambda name: truncate_with_dots(name, 100)
+        )
 
     async def download_id_name_autocomplete(self, ctx: discord.AutocompleteContext):
         server_id = ctx.interaction.guild_id
         if not server_id:
             return []
-        db = get_server_database(server_id)
-        matches = db.get_download_id_names(25, ctx.value, 50)
-        return [truncate_with_dots(f"{id} - {name}", 100) for id, name in matches]
+        db = await get_server_database_async(server_id)
+        return await run_in_db_pool(
+            autocomplete_cache.lookup, db, ctx.interaction.user.id, 'download_id_name', ctx.value,
+            search=lambda query: db.get_download_id_names(AUTOCOMPLETE_LIMIT, query, 50),
+            label=lambda match: truncate_with_dots(f"{match[0]} - {match[1]}", 100)
+        )
 
     @commands.slash_command(name="download", description="Search for a download by name or ID")
     @is_not_ignored()
@@ -64,7 +59,7 @@ class DownloadCommand(commands.Cog):
         name: Option(str, "Enter the download name", autocomplete=download_name_autocomplete, required=False) = None,
         id: Option(str, "Enter the download ID", autocomplete=download_id_autocomplete, required=False) = None
     ):
-        await self.check_cooldown(ctx)
+        check_cooldown(ctx, 'download')
         await self.process_download_request(ctx, name, id)
 
     @commands.slash_command(name="dn", description="Search for a download by name or ID (shortcut)")
@@ -76,20 +71,20 @@ class DownloadCommand(commands.Cog):
         ctx,
         input: Option(str, "Enter the download name or ID", autocomplete=download_id_name_autocomplete, required=True)
     ):
-        await self.check_cooldown(ctx)
+        check_cooldown(ctx, 'download')
         await self.process_download_request(ctx, input, input, True)
 
     async def process_download_request(self, ctx, name, id, both=False):
         server_id = ctx.guild.id
-        db = get_server_database(server_id)
+        db = await get_server_database_async(server_id)
 
         if both:
-            id_name, id_links = db.get_download_entry(id.upper())
+            id_name, id_links = await db.aio.get_download_entry(id.upper())
             if id_name:
                 await self.send_single_result_embed(ctx, id_name, id, id_links)
                 return
             
-            matching_downloads = db.get_matching_downloads(100, name, 70)
+            matching_downloads = await db.aio.get_matching_downloads(100, name, 70)
             if matching_downloads:
                 await self.send_multiple_results_embed(ctx, matching_downloads)
                 return
@@ -98,13 +93,13 @@ class DownloadCommand(commands.Cog):
             return
 
         if id:
-            name, links = db.get_download_entry(id.upper())
+            name, links = await db.aio.get_download_entry(id.upper())
             if not name:
                 await ctx.respond(f"No download found with ID: {id}", ephemeral=True)
                 return
             await self.send_single_result_embed(ctx, name, id, links)
         elif name:
-            matching_downloads = db.get_matching_downloads(100, name, 70)
+            matching_downloads = await db.aio.get_matching_downloads(100, name, 70)
             if not matching_downloads:
                 await ctx.respond(f"No downloads found matching '{name}'.", ephemeral=True)
                 return
@@ -114,7 +109,7 @@ class DownloadCommand(commands.Cog):
 
     async def send_single_result_embed(self, ctx, name, id, links):
         embed = self.create_base_embed(ctx)
-        linked_name = self.create_linked_name(name, links)
+        linked_name = self.create_linked_name(name, links, ctx.guild.id)
         embed.add_field(name=linked_name, value=f"ID: {id}", inline=False)
         await ctx.respond(embed=embed)
 
@@ -127,7 +122,7 @@ class DownloadCommand(commands.Cog):
         for download in matching_downloads[:3]:
             name = truncate_with_dots(download['name'], 256)
             links = download['links']
-            linked_name = self.create_linked_name(name, links)
+            linked_name = self.create_linked_name(name, links, ctx.guild.id)
             embed.add_field(name=linked_name, value=f"ID: {download['id']}", inline=False)
         
         await ctx.respond(embed=embed)
@@ -147,13 +142,13 @@ class DownloadCommand(commands.Cog):
 
         return embed
     
-    def create_linked_name(self, name, links):
+    def create_linked_name(self, name, links, guild_id):
         if not links:
             return name
 
         linked_name = " ("
         
-        urls = list(links.values())
+        urls = [jump_url(guild_id, channel_id, message_id) for channel_id, message_id in links.items()]
         if len(urls) == 1:
             linked_name += urls[0]
         else:
@@ -169,10 +164,5 @@ class DownloadCommand(commands.Cog):
             await ctx.respond(f"This command is on cooldown. Please try again in {error.retry_after:.2f} seconds.", ephemeral=True)
             return
 
-    @commands.Cog.listener()
-    async def on_config_update(self, server_id):
-        if server_id in self.cooldown_mappings:
-            del self.cooldown_mappings[server_id]
-
 def setup(bot):
     bot.add_cog(DownloadCommand(bot))
\ No newline at end of file
@@ -1,44 +1,58 @@
+import asyncio
+import time
 import discord
 from discord.ext import commands
 
-from core.config import load_config, server_configs
-from core.utils import process_download_message, process_video_message, scan_download_channel, scan_video_channel
+from core.config import load_config, load_policy
+from core.checkpoints import catch_up_pending
+from core.ingest import get_ingest
+from core.scan_jobs import catch_up_guild
+from core.titles import pending_titles
+from core.utils import EditedMessage, process_download_edit, process_video_edit, remove_deleted_messages
 from core.guards import UserIgnoredError, NotAllowedChannelError
 from core.logger import get_server_logger
+from core.preload import preload_guilds
 
 class Events(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.preload_task = None
+        self.catch_up_task = None
 
     @commands.Cog.listener()
     async def on_ready(self):
         print(f'Logged in as {self.bot.user.name}')
 
-        for guild in self.bot.guilds:
-            server_id = guild.id
-            serverLogger = get_server_logger(server_id)
-            config = load_config(server_id)
-            server_configs[server_id] = config
-
-            serverLogger.logger.info(f'Bot is ready in guild: {guild.name} (ID: {server_id})')
-            print(f'Bot is ready in guild: {guild.name} (ID: {server_id})')
+        # on_ready fires again after a reconnect, the guilds only need to be preloaded once
+        if self.preload_task is None:
+            self.preload_task = asyncio.create_task(preload_guilds(list(self.bot.guilds)))
 
-            # # Disabled but kept it in. It automatically starts scanning on restart, but I don't think it's actually needed
-            #
-            # for channel_id, channel_name in config['download_channels'].items():
-            #     channel = discord.utils.get(guild.channels, name=channel_name)
-            #     if channel:
-            #         await scan_download_channel(None, channel, server_id)
-            #         logger.logger.info(f'Scanned download channel: {channel.name}')
-
-            # for channel_id, channel_name in config['video_channels'].items():
-            #     channel = discord.utils.get(guild.channels, name=channel_name)
-            #     if channel:
-            #         await scan_video_channel(None, channel, server_id)
-            #         logger.logger.info(f'Scanned video channel: {channel.name}')
+        # Ingests what was posted while the bot was offline or disconnected, from each channel's scan checkpoint on
+        if self.catch_up_task is None or self.catch_up_task.done():
+            # Live messages leave the checkpoints alone until the guild's catch-up scans are queued
+            catch_up_pending.update(guild.id for guild in self.bot.guilds)
+            before = discord.utils.time_snowflake(discord.utils.utcnow())
+            self.catch_up_task = asyncio.create_task(self.catch_up(list(self.bot.guilds), before))
 
         print('Initialization complete')
 
+        started_at = getattr(self.bot, 'started_at', None)
+        if started_at is not None:
+            print(f'Ready after {time.perf_counter() - started_at:.2f}s')
+
+    async def catch_up(self, guilds, before):
+        # After the warm-up, so both don't load the same guilds at the same time. The scans
+        # themselves run on the scan scheduler.
+        await self.preload_task
+        for guild in guilds:
+            try:
+                await catch_up_guild(guild, before)
+            except Exception as e:
+                get_server_logger(guild.id).logger.error(f'Catch-up of guild {guild.name} (ID: {guild.id}) failed: {e}')
+                print(f'Catch-up of guild {guild.name} (ID: {guild.id}) failed: {e}')
+            finally:
+                catch_up_pending.discard(guild.id)
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author == self.bot.user:
@@ -53,19 +67,57 @@ class Events(commands.Cog):
         if not server_id:
             raise commands.NoPrivateMessage("This command cannot be used in private messages.")
         
-        config = server_configs.get(server_id) or load_config(server_id)
-        serverLogger = get_server_logger(server_id)
+        policy = load_policy(server_id)
 
-        if str(message.author.id) in config['ignored_users']:
+        if message.author.id in policy.ignored_users:
             return
 
-        if str(message.channel.id) in config['download_channels']:
-            serverLogger.logger.info(f"Processing download message in channel: {message.channel.name}")
-            await process_download_message(message)
+        kinds = []
+        if message.channel.id in policy.download_channels:
+            get_server_logger(server_id).logger.info(f"Processing download message in channel: {message.channel.name}")
+            kinds.append('download')
 
-        if str(message.channel.id) in config['video_channels']:
-            serverLogger.logger.info(f"Processing video message in channel: {message.channel.name}")
-            await process_video_message(message)
+        if message.channel.id in policy.video_channels:
+            get_server_logger(server_id).logger.info(f"Processing video message in channel: {message.channel.name}")
+            kinds.append('video')
+
+        # Parsed and stored by the guild's ingest worker, see core/ingest.py
+        if kinds:
+            await get_ingest(server_id).add_message(message, kinds)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        # Discord adds link embeds with an edit, which completes the title of a post stored under a placeholder
+        await pending_titles.on_edit(payload.message_id, payload.data)
+
+        # Edits that only carry the embeds leave the post itself unchanged
+        if payload.guild_id is None or 'content' not in payload.data:
+            return
+        author_id = int(payload.data.get('author', {}).get('id', 0))
+        if author_id == self.bot.user.id:
+            return
+
+        server_id = payload.guild_id
+        policy = load_policy(server_id)
+        if author_id in policy.ignored_users:
+            return
+
+        # Queued behind the post itself when it has not been stored yet
+        message = EditedMessage(payload.message_id, payload.data)
+        if payload.channel_id in policy.download_channels:
+            await get_ingest(server_id).add_call(process_download_edit, server_id, payload.channel_id, message)
+        if payload.channel_id in policy.video_channels:
+            await get_ingest(server_id).add_call(process_video_edit, server_id, payload.channel_id, message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        if payload.guild_id is not None:
+            await get_ingest(payload.guild_id).add_call(remove_deleted_messages, payload.guild_id, payload.channel_id, [payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        if payload.guild_id is not None:
+            await get_ingest(payload.guild_id).add_call(remove_deleted_messages, payload.guild_id, payload.channel_id, list(payload.message_ids))
 
     @commands.Cog.listener()
     async def on_application_command_error(self, ctx: discord.ApplicationContext, error: discord.DiscordException):
@@ -74,7 +126,7 @@ class Events(commands.Cog):
         if(ctx.guild):
             server_id = ctx.guild.id
             serverLogger = get_server_logger(server_id)
-            config = server_configs.get(server_id) or load_config(server_id)
+            config = load_config(server_id)
 
         if isinstance(error, Exception) and not isinstance(error, discord.DiscordException):
             if(server_id):
@@ -37,12 +37,13 @@ class HelpCommand(commands.Cog):
             embed.add_field(name="/config ignore [action] [user]", value="Ignore, unignore, or list ignored users.", inline=False)
             embed.add_field(name="/config videochannel [action] [channel]", value="Manage video channels (add, remove, scan, list).", inline=False)
             embed.add_field(name="/config downloadchannel [action] [channel]", value="Manage channels where download links can be found (add, remove, scan, list).", inline=False)
+            embed.add_field(name="/config scan [action] [channel]", value="Show the running and queued channel scans and the live ingest queue, or cancel scans (status, cancel).", inline=False)
 
         if is_admin:
             # Admin commands
             embed.add_field(name="\u200b", value="", inline=False)
             embed.add_field(name="__**Admin Commands**__", value="", inline=False)
-            embed.add_field(name="/config cooldown [limit] [timeout]", value="Configure cooldown settings for /download, /dn, and /video commands.", inline=False)
+            embed.add_field(name="/config cooldown [limit] [timeout] [shared]", value="Configure cooldown settings for /download, /dn, and /video commands. Each user can run `limit` commands at once and gets one back every `timeout / limit` seconds. With shared, all three commands use one cooldown.", inline=False)
             embed.add_field(name="/config admin_download [allow]", value="Configure admin download permissions.", inline=False)
             embed.add_field(name="/config search_regex [regex]", value="Configure the search regex for download messages.", inline=False)
             embed.add_field(name="/config reset_regex", value="Reset the search regex to default (DN : (.+)).", inline=False)
@@ -1,44 +1,30 @@
+from core.catalog import jump_url
 from core.utils import truncate_with_dots
 import discord
 
 from discord.ext import commands
 from discord.commands import Option
-from discord.ext.commands import CooldownMapping, BucketType
 
+from core.autocomplete import autocomplete_cache, AUTOCOMPLETE_LIMIT
 from core.guards import is_not_ignored, in_allowed_channel
-from core.database import get_server_database
+from core.database import get_server_database_async, run_in_db_pool
 from core.logger import command_logger
-from core.config import load_config
+from core.cooldowns import check_cooldown
 
 class VideoCommand(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.cooldown_mappings = {}
-
-    def get_cooldown_mapping(self, server_id):
-        if server_id not in self.cooldown_mappings:
-            config = load_config(server_id)
-            self.cooldown_mappings[server_id] = CooldownMapping.from_cooldown(
-                config.get('cooldown', {}).get('limit', 1),
-                config.get('cooldown', {}).get('timeout', 3),
-                BucketType.user
-            )
-        return self.cooldown_mappings[server_id]
-
-    async def check_cooldown(self, ctx):
-        server_id = ctx.guild.id
-        bucket = self.get_cooldown_mapping(server_id).get_bucket(ctx)
-        retry_after = bucket.update_rate_limit()
-        if retry_after:
-            raise commands.CommandOnCooldown(bucket, retry_after, BucketType.user)
-        return True
 
     async def video_title_autocomplete(self, ctx: discord.AutocompleteContext):
         server_id = ctx.interaction.guild_id
         if not server_id:
             return []
-        db = get_server_database(server_id)
-        return [truncate_with_dots(id, 100) for id in db.get_video_names(100, ctx.value)]
+        db = await get_server_database_async(server_id)
+        return await run_in_db_pool(
+            autocomplete_cache.lookup, db, ctx.interaction.user.id, 'video_title', ctx.value,
+            search=lambda query: db.get_video_names(AUTOCOMPLETE_LIMIT, query),
+            label=lambda name: truncate_with_dots(name, 100)
+        )
 
     @commands.slash_command(name="video", description="Search for a video by title")
     @is_not_ignored()
@@ -49,12 +35,12 @@ class VideoCommand(commands.Cog):
         ctx,
         title: Option(str, "Enter the video title", autocomplete=video_title_autocomplete, required=True)
     ):
-        await self.check_cooldown(ctx)
+        check_cooldown(ctx, 'video')
         
         server_id = ctx.guild.id
-        db = get_server_database(server_id)
+        db = await get_server_database_async(server_id)
 
-        matching_videos = db.get_matching_videos(100, title, 90)
+        matching_videos = await db.aio.get_matching_videos(100, title, 90)
 
         if not matching_videos:
             await ctx.respond("No videos found matching your query.", ephemeral=True)
@@ -81,19 +67,19 @@ class VideoCommand(commands.Cog):
             links = video['links']
             tag = video.get('tag', 'No tag')
             
-            linked_name = self.create_linked_name(name, links)
+            linked_name = self.create_linked_name(name, links, ctx.guild.id)
             
             embed.add_field(name=linked_name, value=f"*{tag}*", inline=False)
 
         await ctx.respond(embed=embed)
 
-    def create_linked_name(self, name, links):
+    def create_linked_name(self, name, links, guild_id):
         if not links:
             return name
 
         linked_name = " ("
         
-        urls = list(links.values())
+        urls = [jump_url(guild_id, channel_id, message_id) for channel_id, message_id in links.items()]
         if len(urls) == 1:
             linked_name += urls[0]
         else:
@@ -108,10 +94,5 @@ class VideoCommand(commands.Cog):
             await ctx.respond(f"This command is on cooldown. Please try again in {error.retry_after:.2f} seconds.", ephemeral=True)
             return
 
-    @commands.Cog.listener()
-    async def on_config_update(self, server_id):
-        if server_id in self.cooldown_mappings:
-            del self.cooldown_mappings[server_id]
-
 def setup(bot):
     bot.add_cog(VideoCommand(bot))
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+# Discord never shows more than 25 autocomplete choices
+AUTOCOMPLETE_LIMIT = 25
+AUTOCOMPLETE_CACHE_SIZE = 10000
+# Matches kept per entry for narrowing, so a short query on a big guild does not keep every row
+AUTOCOMPLETE_NARROW_ITEMS = 200
+
+class AutocompleteEntry:
+    __slots__ = ('generation', 'query', 'items', 'complete', 'labels')
+
+    def __init__(self, generation, query, items, complete, labels):
+        self.generation = generation
+        self.query = query
+        # The first matches in result order, all of them when complete
+        self.items = items
+        self.complete = complete
+        self.labels = labels
+
+class AutocompleteCache:
+    # Remembers the last autocomplete result per (guild, user, kind). A repeated query is
+    # answered from the cache, and when the matcher is a plain substring filter a query that
+    # extends the previous one only re-checks the previous matches. Only the first
+    # AUTOCOMPLETE_NARROW_ITEMS matches are kept, when narrowing those leaves fewer than a full
+    # page the query is searched again. Entries are dropped as soon as the guild's database
+    # generation changes, which includes the database being evicted and loaded again.
+    def __init__(self, max_entries=AUTOCOMPLETE_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        # Lookups run on the database pool, the lock only guards the bookkeeping
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.narrowed = 0
+        self.misses = 0
+
+    def lookup(self, db, user_id, kind, query, search, label, narrow=None):
+        # search(query) returns the matching items, narrow(items, query) filters a previous
+        # result down for a longer query and label(item) builds the choice shown to the user
+        query = query or ''
+        key = (db.server_id, user_id, kind)
+        generation = db.generation
+        with self._lock:
+            entry = self.entries.get(key)
+
+        if entry is not None and entry.generation == generation:
+            if entry.query == query:
+                with self._lock:
+                    self.hits += 1
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                return entry.labels
+            if narrow is not None and entry.query and query.lower().startswith(entry.query.lower()):
+                # Narrowing keeps the result order, so the matches of the kept items are the
+                # first ones of the full result. Past the last kept item there may be more.
+                items = narrow(entry.items, query)
+                if entry.complete or len(items) >= AUTOCOMPLETE_LIMIT:
+                    with self._lock:
+                        self.narrowed += 1
+                    return self._store(key, generation, query, items, label, entry.complete)
+
+        with self._lock:
+            self.misses += 1
+        return self._store(key, generation, query, search(query), label)
+
+    def _store(self, key, generation, query, items, label, complete=True):
+        labels = [label(item) for item in items[:AUTOCOMPLETE_LIMIT]]
+        complete = complete and len(items) <= AUTOCOMPLETE_NARROW_ITEMS
+        with self._lock:
+            self.entries[key] = AutocompleteEntry(generation, query, items[:AUTOCOMPLETE_NARROW_ITEMS], complete, labels)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return labels
+
+autocomplete_cache = AutocompleteCache()
@@ -0,0 +1,126 @@
+import re
+import struct
+import sys
+
+# Compact in-memory tables for the download and video catalogs. Every column is a plain
+# list indexed by row, and the links column holds bytes instead of a dict: one packed
+# (channel ID, message ID) pair per link. Jump URLs are only built when a result is shown.
+
+JUMP_URL = re.compile(r'https://discord\.com/channels/(\d+)/(\d+)/(\d+)')
+JUMP_URL_FORMAT = 'https://discord.com/channels/{}/{}/{}'
+PACKED_LINK = struct.Struct('<QQ')
+
+def jump_url(guild_id, channel_id, message_id):
+    return JUMP_URL_FORMAT.format(guild_id, channel_id, message_id)
+
+def is_legacy_links(links):
+    # Links used to be stored as channel name -> jump URL
+    return any(not isinstance(message_id, int) for message_id in links.values())
+
+def normalize_links(links):
+    # channel ID -> message ID, from either format. Keys are strings after a JSON round trip.
+    normalized = {}
+    for key, value in links.items():
+        if isinstance(value, int):
+            channel_id, message_id = int(key), value
+        else:
+            match = JUMP_URL.fullmatch(value)
+            if not match:
+                continue
+            channel_id, message_id = int(match.group(2)), int(match.group(3))
+        # A renamed channel used to get a second key, the newest message wins
+        if message_id >= normalized.get(channel_id, 0):
+            normalized[channel_id] = message_id
+    return normalized
+
+def encode_links(links):
+    return b''.join(PACKED_LINK.pack(channel_id, message_id) for channel_id, message_id in links.items())
+
+def decode_links(encoded):
+    return dict(PACKED_LINK.iter_unpack(encoded))
+
+def lower(value):
+    # Reuse the string itself when it is already lowercase instead of storing a copy
+    lowered = value.lower()
+    return value if lowered == value else lowered
+
+class CatalogTable:
+    __slots__ = ('columns', 'data', 'changed')
+
+    def __init__(self, columns, data=None):
+        self.columns = columns
+        self.data = data if data is not None else {column: [] for column in columns}
+        # Rows written since the owner last reset it, None when nobody keeps track
+        self.changed = None
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        table = cls(columns)
+        for row in rows:
+            table.append(row)
+        return table
+
+    def __len__(self):
+        return len(self.data[self.columns[0]])
+
+    def append(self, row):
+        for column in self.columns:
+            value = row[column]
+            self.data[column].append(encode_links(value) if column == 'links' else value)
+        if self.changed is not None:
+            self.changed.add(len(self) - 1)
+        return len(self) - 1
+
+    def get(self, row, column):
+        value = self.data[column][row]
+        return decode_links(value) if column == 'links' else value
+
+    def set(self, row, column, value):
+        self.data[column][row] = encode_links(value) if column == 'links' else value
+        if self.changed is not None:
+            self.changed.add(row)
+
+    def column(self, column):
+        return self.data[column]
+
+    def record(self, row):
+        return {column: self.get(row, column) for column in self.columns}
+
+    def records(self, rows):
+        return [self.record(row) for row in rows]
+
+    def tail(self, count):
+        size = len(self)
+        return range(max(size - count, 0), size)
+
+    def delete(self, row):
+        # The row keeps its position so row numbers stay valid, a deleted row has empty values
+        for column in self.columns:
+            self.data[column][row] = b'' if column == 'links' else ''
+        if self.changed is not None:
+            self.changed.add(row)
+
+    def copy(self, key=None):
+        # Values are immutable (strings and bytes), so copying the column lists is enough.
+        # With a key column, deleted rows (an empty key) are left out.
+        if key is None:
+            return CatalogTable(self.columns, {column: values.copy() for column, values in self.data.items()})
+        rows = [row for row, value in enumerate(self.data[key]) if value]
+        return CatalogTable(self.columns, {column: [values[row] for row in rows] for column, values in self.data.items()})
+
+    def memory_usage(self):
+        # Bytes held by the column lists and their values, shared objects are only counted once
+        seen = set()
+        total = 0
+
+        def add(obj):
+            nonlocal total
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+
+        for values in self.data.values():
+            add(values)
+            for value in values:
+                add(value)
+        return total
@@ -0,0 +1,86 @@
+import atexit
+import json
+import os
+import threading
+
+from core.config import DATA_DIR, GUILD_IDLE_TTL
+from core.guild_cache import GuildCache
+from core.journal import write_atomic
+
+# Per channel scan checkpoints: the ID of the newest message a scan has processed, per scan
+# kind ('download' or 'video'). They are kept in data/<server_id>/scan_checkpoints.json, so
+# a scan resumes where the previous one stopped and the catch-up after a restart only reads
+# the messages that were posted while the bot was offline.
+
+KINDS = ('download', 'video')
+
+# Checkpoints that only a scan may move, see advance_live(). They are kept here instead of in
+# ScanCheckpoints, so they survive the checkpoints of a guild being unloaded while a scan waits.
+# (server_id, kind, channel_id) of every queued and running scan
+held_channels = set()
+# Guilds whose catch-up after on_ready has not queued its scans yet
+catch_up_pending = set()
+
+class ScanCheckpoints:
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.file_path = os.path.join(DATA_DIR, str(server_id), 'scan_checkpoints.json')
+        self._lock = threading.Lock()
+        self.dirty = False
+
+        self.checkpoints = {kind: {} for kind in KINDS}
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, 'r') as f:
+                    stored = json.load(f)
+                for kind in KINDS:
+                    self.checkpoints[kind] = {int(channel_id): message_id for channel_id, message_id in stored.get(kind, {}).items()}
+            except (IOError, ValueError, AttributeError) as e:
+                # A lost checkpoint only means the next scan of the channel starts from the beginning
+                from core.logger import get_server_logger
+                get_server_logger(server_id).logger.error(f"Error loading scan checkpoints for server {server_id}: {e}")
+
+    def get(self, kind, channel_id):
+        with self._lock:
+            return self.checkpoints[kind].get(channel_id)
+
+    def advance(self, kind, channel_id, message_id):
+        with self._lock:
+            if message_id > self.checkpoints[kind].get(channel_id, 0):
+                self.checkpoints[kind][channel_id] = message_id
+                self.dirty = True
+
+    def advance_live(self, kind, channel_id, message_id):
+        # A live message only moves a checkpoint the channel already has and that no queued,
+        # running or pending catch-up scan is going to move. Otherwise a restart would skip the
+        # messages that scan has not reached yet.
+        if self.server_id in catch_up_pending or (self.server_id, kind, channel_id) in held_channels:
+            return
+        with self._lock:
+            if channel_id not in self.checkpoints[kind]:
+                return
+        self.advance(kind, channel_id, message_id)
+
+    def reset(self, kind):
+        with self._lock:
+            if self.checkpoints[kind]:
+                self.checkpoints[kind] = {}
+                self.dirty = True
+        self.save()
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            stored = {kind: {str(channel_id): message_id for channel_id, message_id in checkpoints.items()} for kind, checkpoints in self.checkpoints.items()}
+            self.dirty = False
+
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        write_atomic(self.file_path, lambda f: json.dump(stored, f, indent=4, sort_keys=True))
+
+scan_checkpoints = GuildCache(load=ScanCheckpoints, close=ScanCheckpoints.save, idle_ttl=GUILD_IDLE_TTL)
+
+def get_scan_checkpoints(server_id):
+    return scan_checkpoints.get(server_id)
+
+atexit.register(scan_checkpoints.clear)
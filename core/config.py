@@ -1,10 +1,57 @@
 import json
 import os
-from core.logger import get_server_logger
+from collections import namedtuple
 from discord.ext import commands
 
+from core.guild_cache import GuildCache
+
 DATA_DIR = 'data'
 
+# Per deployment storage backend for the download/video databases: 'binary', 'csv' or 'sqlite'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'binary').lower()
+
+# Database writes are coalesced and flushed after this many seconds or this many changes, whichever comes first
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '2'))
+DB_FLUSH_MAX_CHANGES = int(os.getenv('DB_FLUSH_MAX_CHANGES', '500'))
+
+# Number of threads that run database loads, searches and writes off the event loop
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))
+
+# Worker processes for fuzzy scoring (0 keeps scoring in the bot process), only used for
+# search columns with at least SEARCH_PROCESS_MIN_ROWS entries
+SEARCH_PROCESSES = int(os.getenv('SEARCH_PROCESSES', '0'))
+SEARCH_PROCESS_MIN_ROWS = int(os.getenv('SEARCH_PROCESS_MIN_ROWS', '20000'))
+
+# Number of guilds loaded at the same time by the background warm-up after startup
+PRELOAD_CONCURRENCY = int(os.getenv('PRELOAD_CONCURRENCY', '2'))
+
+# Per-guild state is unloaded after GUILD_IDLE_TTL seconds without use (0 keeps it loaded).
+# Loaded databases are also kept under GUILD_CACHE_MAX_MB in total and open log files under MAX_OPEN_LOGS.
+GUILD_IDLE_TTL = float(os.getenv('GUILD_IDLE_TTL', '3600'))
+GUILD_CACHE_MAX_MB = int(os.getenv('GUILD_CACHE_MAX_MB', '1024'))
+MAX_OPEN_LOGS = int(os.getenv('MAX_OPEN_LOGS', '500'))
+
+# Channel scans parse history pages on SCAN_PARSE_WORKERS workers and store the results every
+# SCAN_BATCH_SIZE messages
+SCAN_PARSE_WORKERS = int(os.getenv('SCAN_PARSE_WORKERS', '4'))
+SCAN_BATCH_SIZE = int(os.getenv('SCAN_BATCH_SIZE', '1000'))
+
+# Seconds to wait for Discord to add the embed with the title of a new post before fetching it once
+TITLE_FALLBACK_DELAY = float(os.getenv('TITLE_FALLBACK_DELAY', '10'))
+
+# At most SCAN_MAX_CONCURRENT scans run at a time over all guilds and SCAN_MAX_PER_GUILD per
+# guild, the rest wait in the queue. Together they send at most SCAN_REQUESTS_PER_SECOND
+# history requests, and progress messages are edited at most every SCAN_PROGRESS_INTERVAL seconds.
+SCAN_MAX_CONCURRENT = int(os.getenv('SCAN_MAX_CONCURRENT', '2'))
+SCAN_MAX_PER_GUILD = int(os.getenv('SCAN_MAX_PER_GUILD', '1'))
+SCAN_REQUESTS_PER_SECOND = float(os.getenv('SCAN_REQUESTS_PER_SECOND', '4'))
+SCAN_PROGRESS_INTERVAL = float(os.getenv('SCAN_PROGRESS_INTERVAL', '5'))
+
+# Live messages wait in a per-guild ingest queue of at most INGEST_QUEUE_SIZE messages and are
+# stored up to INGEST_BATCH_SIZE at a time
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '1000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '100'))
+
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
@@ -28,14 +75,7 @@ def get_server_config_file(server_id):
         os.makedirs(server_dir)
     return os.path.join(server_dir, 'config.json')
 
-server_configs = {}
-
-def load_config(server_id):
-    if not server_id:
-        raise commands.NoPrivateMessage("This command cannot be used in private messages.")
-    if server_id in server_configs:
-        return server_configs[server_id]
-
+def _read_config(server_id):
     config_file = get_server_config_file(server_id)
     if not os.path.exists(config_file):
         config = default_config()
@@ -44,18 +84,55 @@ def load_config(server_id):
             with open(config_file, 'r') as f:
                 config = json.load(f)
         except (IOError, json.JSONDecodeError) as e:
+            # core.logger reads its limits from this module
+            from core.logger import get_server_logger
             serverLogger = get_server_logger(server_id)
             serverLogger.logger.error(f"Error loading config for server {server_id}: {e}")
             config = default_config()
-
-    server_configs[server_id] = config
     return config
 
+server_configs = GuildCache(load=_read_config, idle_ttl=GUILD_IDLE_TTL)
+
+def load_config(server_id):
+    if not server_id:
+        raise commands.NoPrivateMessage("This command cannot be used in private messages.")
+    return server_configs.get(server_id)
+
+# Immutable view of the settings that are checked on every message and command, with the IDs
+# as ints. It is only replaced as a whole by save_config, so a check never sees half an update.
+GuildPolicy = namedtuple('GuildPolicy', [
+    'ignored_users', 'allowed_channels', 'download_channels', 'video_channels', 'admin_always_download',
+    'cooldown_limit', 'cooldown_timeout', 'cooldown_shared',
+])
+
+def _ids(mapping):
+    return frozenset(int(id) for id in mapping if str(id).isdigit())
+
+def build_policy(config):
+    return GuildPolicy(
+        ignored_users=_ids(config.get('ignored_users', {})),
+        allowed_channels=_ids(config.get('allowed_channels', {})),
+        download_channels=_ids(config.get('download_channels', {})),
+        video_channels=_ids(config.get('video_channels', {})),
+        admin_always_download=config.get('admin_always_download', False),
+        cooldown_limit=config.get('cooldown', {}).get('limit', 1),
+        cooldown_timeout=config.get('cooldown', {}).get('timeout', 3),
+        cooldown_shared=config.get('cooldown', {}).get('shared', False),
+    )
+
+server_policies = GuildCache(load=lambda server_id: build_policy(load_config(server_id)), idle_ttl=GUILD_IDLE_TTL)
+
+def load_policy(server_id):
+    if not server_id:
+        raise commands.NoPrivateMessage("This command cannot be used in private messages.")
+    return server_policies.get(server_id)
+
 def save_config(server_id, config, bot=None):
     if not server_id:
         raise commands.NoPrivateMessage("This command cannot be used in private messages.")
     
-    server_configs[server_id] = config
+    server_configs.put(server_id, config)
+    server_policies.put(server_id, build_policy(config))
     config_file = get_server_config_file(server_id)
     with open(config_file, 'w') as f:
         json.dump(config, f, indent=4, sort_keys=True)
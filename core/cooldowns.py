@@ -0,0 +1,56 @@
+import time
+from discord.ext import commands
+from discord.ext.commands import BucketType, Cooldown
+
+from core.config import load_policy
+
+# Command cooldowns of all guilds in one place. Every (guild, quota, user) gets a token bucket
+# that holds the guild's cooldown limit and refills completely over its timeout. A command
+# takes one token, so a user can run `limit` commands at once and then one more every
+# timeout / limit seconds. Commands that name the same quota share a bucket, and a guild can
+# make all commands share one with the shared cooldown setting.
+
+# Seconds between sweeps for buckets that have refilled completely
+SWEEP_INTERVAL = 60
+
+class CooldownService:
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        self.sweep_interval = sweep_interval
+        # (server_id, quota, user_id) -> (tokens, updated at, full at)
+        self.buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key, limit, per):
+        # Takes a token from the bucket, returns 0 or the seconds until the next token
+        if limit <= 0 or per <= 0:
+            return 0
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        bucket = self.buckets.get(key)
+        tokens = limit if bucket is None else min(limit, bucket[0] + (now - bucket[1]) * limit / per)
+        if tokens < 1:
+            return (1 - tokens) * per / limit
+
+        tokens -= 1
+        self.buckets[key] = (tokens, now, now + (limit - tokens) * per / limit)
+        return 0
+
+    def sweep(self, now=None):
+        # A full bucket is the same as no bucket, so only users within their timeout take memory
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        expired = [key for key, bucket in self.buckets.items() if bucket[2] <= now]
+        for key in expired:
+            del self.buckets[key]
+        return len(expired)
+
+cooldowns = CooldownService()
+
+def check_cooldown(ctx, quota):
+    policy = load_policy(ctx.guild.id)
+    key = (ctx.guild.id, 'shared' if policy.cooldown_shared else quota, ctx.author.id)
+    retry_after = cooldowns.hit(key, policy.cooldown_limit, policy.cooldown_timeout)
+    if retry_after:
+        raise commands.CommandOnCooldown(Cooldown(policy.cooldown_limit, policy.cooldown_timeout), retry_after, BucketType.user)
@@ -1,185 +1,795 @@
+import asyncio
+import atexit
+import functools
+import itertools
 import os
-import json
-import pandas as pd
-from fuzzywuzzy import fuzz
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from discord.ext import commands
 
-from core.config import DATA_DIR
+from core.config import (
+    DATA_DIR, STORAGE_BACKEND, DB_FLUSH_INTERVAL, DB_FLUSH_MAX_CHANGES, DB_WORKERS,
+    SEARCH_PROCESSES, SEARCH_PROCESS_MIN_ROWS, GUILD_CACHE_MAX_MB, GUILD_IDLE_TTL,
+)
+from core.guild_cache import GuildCache
 from core.logger import get_server_logger
+from core import search
+from core.catalog import CatalogTable, decode_links, lower
+from core.search_pool import SearchPool, SharedColumn
+from core.storage import TABLES, open_storage
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
+# Bounded pool that runs database loads, searches and writes off the event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='database')
+
+async def run_in_db_pool(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+# Rough memory cost of a loaded database for the guild cache: a fixed part, the catalog
+# bytes per entry measured at load (ENTRY_BYTES until there are entries) and the search
+# columns, indexes and snapshot on top of that, measured with 100k synthetic entries
+DATABASE_BASE_BYTES = 64 * 1024
+ENTRY_BYTES = 300
+INDEX_BYTES_PER_ENTRY = 550
+
+# Snapshots after the first one only carry the rows changed since the last full copy. The state
+# is copied in full again once more than 1/SNAPSHOT_DELTA_SHARE of the rows, and at least
+# SNAPSHOT_MIN_DELTA_ROWS, changed since.
+SNAPSHOT_DELTA_SHARE = 32
+SNAPSHOT_MIN_DELTA_ROWS = 256
+
+# Generations are unique across all databases of the process, so a database that was evicted
+# and loaded again never repeats one that caches built on the old instance remember
+generations = itertools.count(1)
+
+# Fuzzy scoring of big search columns is handed to worker processes when SEARCH_PROCESSES > 0
+search_pool = SearchPool(SEARCH_PROCESSES, SEARCH_PROCESS_MIN_ROWS)
+
+class AsyncServerDatabase:
+    # Awaitable view of a ServerDatabase, every method call runs on the database pool
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_db_pool(method, *args, **kwargs)
+        return call
+
 class ServerDatabase:
     def __init__(self, server_id):
         self.server_id = server_id
         self.server_dir = os.path.join(DATA_DIR, str(server_id))
-        self.serverLogger = get_server_logger(self.server_id)
         
         if not os.path.exists(self.server_dir):
             os.makedirs(self.server_dir)
 
-        self.download_db_file = os.path.join(self.server_dir, 'download_database.csv')
-        self.video_db_file = os.path.join(self.server_dir, 'video_database.csv')
-
-        self.download_db = self._load_or_create_df(self.download_db_file, ['id', 'name', 'links'])
-        self.video_db = self._load_or_create_df(self.video_db_file, ['name', 'tag', 'links'])
-
-    def _load_or_create_df(self, file_path, columns):
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            df['links'] = df['links'].apply(json.loads)
-        else:
-            df = pd.DataFrame(columns=columns)
-        return df
-
-    def _save_df(self, df, file_path):
-        df_to_save = df.copy()
-        df_to_save['links'] = df_to_save['links'].apply(json.dumps)
-        df_to_save.to_csv(file_path, index=False)
-
-    def update_download_database(self, id: str, name, channel, link):
+        self.storage = open_storage(STORAGE_BACKEND, self.server_dir, self.serverLogger.logger)
+
+        # _lock serializes writers. Write scheduler: upserts are coalesced per key in _pending and
+        # flushed together after DB_FLUSH_INTERVAL seconds or DB_FLUSH_MAX_CHANGES changes, on a timer thread
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._pending = {table: {} for table in TABLES}
+        self._pending_changes = 0
+        self._flush_timer = None
+        # Whether the armed timer flushes right away, so a batch over DB_FLUSH_MAX_CHANGES arms it only once
+        self._flush_now = False
+        self.writes_saved = 0
+        self.closed = False
+
+        # Moves on with every change, lets caches built on top of this database notice they are stale
+        self.generation = next(generations)
+        self._current_snapshot = None
+
+        self.aio = AsyncServerDatabase(self)
+
+        self.downloads = self._load_table('download')
+        self.videos = self._load_table('video')
+        # Rows written since the last snapshot
+        self.downloads.changed = set()
+        self.videos.changed = set()
+        # Rows deleted since the load, they stay in place with empty values until the next load
+        self.deleted_rows = {table: set() for table in TABLES}
+
+        # Pre-lowercased search columns, one entry per row
+        self.download_ids_lower = [lower(id) for id in self.downloads.column('id')]
+        self.download_names_lower = [lower(name) for name in self.downloads.column('name')]
+        self.video_names_lower = [lower(name) for name in self.videos.column('name')]
+
+        # In-memory hash indexes (value -> row) for O(1) exact lookups and upserts
+        self.download_id_index = self._build_index(self.downloads.column('id'))
+        self.download_name_index = self._build_multi_index(self.download_names_lower)
+        self.video_name_index = self._build_index(self.videos.column('name'))
+        # Reverse index message ID -> row of the entry that links to it, for raw edit and delete events
+        self.message_rows = {'download': self._build_message_index(self.downloads), 'video': self._build_message_index(self.videos)}
+
+        # Measured once at load, memory_estimate() scales it with the number of entries
+        self.entry_bytes = ENTRY_BYTES
+        entries = len(self.downloads) + len(self.videos)
+        if entries:
+            self.entry_bytes = (self.downloads.memory_usage() + self.videos.memory_usage()) // entries
+            self.serverLogger.logger.info(f"Server {self.server_id}: Loaded {entries} entries ({self.entry_bytes} bytes per entry)")
+
+    @property
+    def serverLogger(self):
+        # Looked up on every use, the logger can be evicted and reloaded while the database stays loaded
+        return get_server_logger(self.server_id)
+
+    def _load_table(self, table):
+        return self.storage.load_table(table)
+
+    def _build_index(self, column):
+        index = {}
+        for row, value in enumerate(column):
+            # Keep the first occurrence, same as the old boolean-mask lookups did
+            index.setdefault(value, row)
+        return index
+
+    def _build_multi_index(self, column):
+        index = {}
+        for row, value in enumerate(column):
+            index.setdefault(value, []).append(row)
+        return index
+
+    def _build_message_index(self, rows):
+        index = {}
+        for row, encoded in enumerate(rows.column('links')):
+            for message_id in decode_links(encoded).values():
+                index[message_id] = row
+        return index
+
+    def _index_message(self, table, row, old_message_id, message_id):
+        # The message that was linked for the channel before is replaced by message_id
+        index = self.message_rows[table]
+        if old_message_id is not None and old_message_id != message_id and index.get(old_message_id) == row:
+            del index[old_message_id]
+        index[message_id] = row
+
+    def _persist(self, table, row):
+        key = TABLES[table][0]
+        with self._lock:
+            self._pending[table][row[key]] = row
+            self._pending_changes += 1
+
+            if self._pending_changes >= DB_FLUSH_MAX_CHANGES:
+                self._schedule_flush(0)
+            elif self._flush_timer is None:
+                self._schedule_flush(DB_FLUSH_INTERVAL)
+
+    def _persist_delete(self, table, key_value):
+        self._persist(table, {TABLES[table][0]: key_value, 'deleted': True})
+
+    def _schedule_flush(self, delay):
+        if self._flush_timer is not None:
+            if delay > 0 or self._flush_now:
+                return
+            self._flush_timer.cancel()
+        self._flush_now = delay == 0
+        self._flush_timer = threading.Timer(delay, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def flush(self):
+        # _flush_lock keeps flushes in order, _lock is only held while swapping out the pending rows
+        with self._flush_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                    self._flush_now = False
+                pending, changes = self._pending, self._pending_changes
+                self._pending = {table: {} for table in TABLES}
+                self._pending_changes = 0
+
+            if not changes:
+                return
+
+            writes = 0
+            for table, rows in pending.items():
+                if not rows:
+                    continue
+                self.storage.upsert_many(table, list(rows.values()))
+                writes += 1
+
+                if self.storage.needs_compaction(table):
+                    with self._lock:
+                        rows = (self.downloads if table == 'download' else self.videos).copy(TABLES[table][0])
+                    self.storage.compact(table, rows)
+
+            self.writes_saved += changes - writes
+
+        self.serverLogger.logger.info(f"Server {self.server_id}: Flushed {changes} changes in {writes} writes ({self.writes_saved} writes saved so far)")
+
+    def close(self):
+        # Writes that already hold the lock are part of the last flush, later ones are forwarded
+        with self._lock:
+            self.closed = True
+        self.flush()
+        self.storage.close()
+        if self._current_snapshot is not None:
+            self._current_snapshot.release_shared()
+
+    def memory_estimate(self):
+        return DATABASE_BASE_BYTES + (len(self.downloads) + len(self.videos)) * (self.entry_bytes + INDEX_BYTES_PER_ENTRY)
+
+    def update_download_database(self, id: str, name, channel_id: int, message_id: int):
+        if not self._update_downloads([(id, name, channel_id, message_id)]):
+            # This instance was evicted while the caller still held it, the reloaded one takes the write
+            get_server_database(self.server_id).update_download_database(id, name, channel_id, message_id)
+
+    def update_video_database(self, name, channel_id: int, message_id: int, tag):
+        if not self._update_videos([(name, channel_id, message_id, tag)]):
+            get_server_database(self.server_id).update_video_database(name, channel_id, message_id, tag)
+
+    def update_download_entries(self, entries, wait=True):
+        # Bulk version of update_download_database for scans and the ingest queue: (id, name,
+        # channel_id, message_id) tuples in message order, applied under one lock. With wait the
+        # batch is written before this returns, so a scan checkpoint never gets ahead of what is
+        # stored, otherwise it is left to the write scheduler.
+        if not self._update_downloads(entries, batch=True):
+            get_server_database(self.server_id).update_download_entries(entries, wait)
+            return
+        if wait:
+            self.flush()
+
+    def update_video_entries(self, entries, wait=True):
+        # (name, channel_id, message_id, tag) tuples, see update_download_entries
+        if not self._update_videos(entries, batch=True):
+            get_server_database(self.server_id).update_video_entries(entries, wait)
+            return
+        if wait:
+            self.flush()
+
+    def _update_downloads(self, entries, batch=False):
+        with self._lock:
+            if self.closed:
+                return False
+            added = 0
+            for id, name, channel_id, message_id in entries:
+                added += self._update_download(id, name, channel_id, message_id, log=not batch)
+            # Batches are logged once instead of per entry
+            if batch and entries:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Added {added} and updated {len(entries) - added} entries in link database")
+            return True
+
+    def _update_videos(self, entries, batch=False):
+        with self._lock:
+            if self.closed:
+                return False
+            added = 0
+            for name, channel_id, message_id, tag in entries:
+                added += self._update_video(name, channel_id, message_id, tag, log=not batch)
+            if batch and entries:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Added {added} and updated {len(entries) - added} entries in video database")
+            return True
+
+    def _update_download(self, id, name, channel_id, message_id, log):
+        # Called with _lock held, returns whether a new entry was added
         id = id.upper()
-        existing_entry = self.download_db[self.download_db['id'] == id]
-
-        if not existing_entry.empty:
-            links = existing_entry['links'].iloc[0]
-            links[channel] = link
-            self.download_db.loc[self.download_db['id'] == id, 'name'] = name
-            self.download_db.loc[self.download_db['id'] == id, 'links'] = [links]
-            self.serverLogger.logger.info(f"Server {self.server_id}: Updated existing entry to link database: ID={id}, Name={name}, Channel={channel}")
+        row = self.download_id_index.get(id)
+        added = row is None
+
+        if not added:
+            old_links = self.downloads.get(row, 'links')
+            links = {**old_links, channel_id: message_id}
+            old_name = self.download_names_lower[row]
+            self.downloads.set(row, 'name', name)
+            self.downloads.set(row, 'links', links)
+            self._reindex_name(old_name, lower(name), row)
+            self.download_names_lower[row] = lower(name)
+            if log:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Updated existing entry to link database: ID={id}, Name={name}, Channel={channel_id}")
         else:
-            links = {channel: link}
-            new_entry = pd.DataFrame({'id': [id], 'name': [name], 'links': [links]})
-            self.download_db = pd.concat([self.download_db, new_entry], ignore_index=True)
-            self.serverLogger.logger.info(f"Server {self.server_id}: Added new entry to link database: ID={id}, Name={name}, Channel={channel}")
-
-        self._save_df(self.download_db, self.download_db_file)
-
-    def update_video_database(self, name, channel, link, tag):
-        existing_entry = self.video_db[self.video_db['name'] == name]
-
-        if not existing_entry.empty:
-            links = existing_entry['links'].iloc[0]
-            links[channel] = link
-            self.video_db.loc[self.video_db['name'] == name, 'tag'] = tag
-            self.video_db.loc[self.video_db['name'] == name, 'links'] = [links]
-            self.serverLogger.logger.info(f"Server {self.server_id}: Updated existing entry to video database: Name={name}, Channel={channel}")
+            links = {channel_id: message_id}
+            row = self.downloads.append({'id': id, 'name': name, 'links': links})
+            self.download_id_index[id] = row
+            self.download_name_index[lower(name)] = self.download_name_index.get(lower(name), []) + [row]
+            self.download_ids_lower.append(lower(id))
+            self.download_names_lower.append(lower(name))
+            if log:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Added new entry to link database: ID={id}, Name={name}, Channel={channel_id}")
+
+        self._index_message('download', row, None if added else old_links.get(channel_id), message_id)
+        self.generation = next(generations)
+        self._persist('download', {'id': id, 'name': name, 'links': links})
+        return added
+
+    def _update_video(self, name, channel_id, message_id, tag, log):
+        row = self.video_name_index.get(name)
+        added = row is None
+
+        if not added:
+            old_links = self.videos.get(row, 'links')
+            links = {**old_links, channel_id: message_id}
+            self.videos.set(row, 'tag', tag)
+            self.videos.set(row, 'links', links)
+            if log:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Updated existing entry to video database: Name={name}, Channel={channel_id}")
         else:
-            links = {channel: link}
-            new_entry = pd.DataFrame({'name': [name], 'tag': [tag], 'links': [links]})
-            self.video_db = pd.concat([self.video_db, new_entry], ignore_index=True)
-            self.serverLogger.logger.info(f"Server {self.server_id}: Added new entry to video database: Name={name}, Channel={channel}")
-
-        self._save_df(self.video_db, self.video_db_file)
+            links = {channel_id: message_id}
+            row = self.videos.append({'name': name, 'tag': tag, 'links': links})
+            self.video_name_index[name] = row
+            self.video_names_lower.append(lower(name))
+            if log:
+                self.serverLogger.logger.info(f"Server {self.server_id}: Added new entry to video database: Name={name}, Channel={channel_id}")
+
+        self._index_message('video', row, None if added else old_links.get(channel_id), message_id)
+        self.generation = next(generations)
+        self._persist('video', {'name': name, 'tag': tag, 'links': links})
+        return added
+
+    def rename_video(self, old_name, name, channel_id: int, message_id: int, tag):
+        # Moves the link of one message from the entry old_name to the entry name, for titles
+        # that arrive after the post was stored under a placeholder
+        if not self._rename_video(old_name, name, channel_id, message_id, tag):
+            get_server_database(self.server_id).rename_video(old_name, name, channel_id, message_id, tag)
+
+    def _rename_video(self, old_name, name, channel_id, message_id, tag):
+        # Returns False when this instance was closed, the caller forwards the call without holding _lock
+        with self._lock:
+            if self.closed:
+                return False
+
+            row = self.video_name_index.get(old_name)
+            if row is None or old_name == name:
+                self._update_video(name, channel_id, message_id, tag, log=True)
+                return True
+
+            links = self.videos.get(row, 'links')
+            if links.get(channel_id) == message_id:
+                del links[channel_id]
+                if self.message_rows['video'].get(message_id) == row:
+                    del self.message_rows['video'][message_id]
+
+            if not links and name not in self.video_name_index:
+                # The placeholder only held this message, rename it in place so it keeps its position
+                self.video_name_index.pop(old_name)
+                self.video_name_index[name] = row
+                self.video_names_lower[row] = lower(name)
+                links = {channel_id: message_id}
+                self.message_rows['video'][message_id] = row
+                self.videos.set(row, 'name', name)
+                self.videos.set(row, 'tag', tag)
+                self.videos.set(row, 'links', links)
+                self._persist_delete('video', old_name)
+                self._persist('video', {'name': name, 'tag': tag, 'links': links})
+                self.serverLogger.logger.info(f"Server {self.server_id}: Renamed video entry: Name={old_name} -> {name}")
+                self.generation = next(generations)
+            else:
+                if links:
+                    self.videos.set(row, 'links', links)
+                    self._persist('video', {'name': old_name, 'tag': self.videos.get(row, 'tag'), 'links': links})
+                else:
+                    self._delete_video_row(row)
+                self._update_video(name, channel_id, message_id, tag, log=True)
+        return True
+
+    def move_download_message(self, id, name, channel_id: int, message_id: int):
+        # Stores an edited download post, whose link moves to the entry of its new ID when the ID changed
+        if not self._move_download_message(id, name, channel_id, message_id):
+            get_server_database(self.server_id).move_download_message(id, name, channel_id, message_id)
+
+    def _move_download_message(self, id, name, channel_id, message_id):
+        with self._lock:
+            if self.closed:
+                return False
+            row = self.message_rows['download'].get(message_id)
+            if row is not None and self.downloads.get(row, 'id') != id.upper():
+                self._remove_message('download', message_id)
+            self._update_download(id, name, channel_id, message_id, log=True)
+            return True
+
+    def get_message_entry(self, table, message_id):
+        # The entry that links to the message, or None
+        with self._lock:
+            row = self.message_rows[table].get(message_id)
+            if row is None:
+                return None
+            return (self.downloads if table == 'download' else self.videos).record(row)
+
+    def remove_messages(self, table, message_ids):
+        # Drops the links to deleted messages, entries without links left are removed. Returns
+        # the number of entries that changed.
+        removed = self._remove_messages(table, message_ids)
+        if removed is None:
+            return get_server_database(self.server_id).remove_messages(table, message_ids)
+        return removed
+
+    def _remove_messages(self, table, message_ids):
+        # None when this instance was closed
+        with self._lock:
+            if self.closed:
+                return None
+            return sum(self._remove_message(table, message_id) for message_id in message_ids)
+
+    def _remove_message(self, table, message_id):
+        # Called with _lock held, a single dict lookup for messages no entry links to
+        row = self.message_rows[table].pop(message_id, None)
+        if row is None:
+            return False
+
+        rows = self.downloads if table == 'download' else self.videos
+        links = {channel_id: linked for channel_id, linked in rows.get(row, 'links').items() if linked != message_id}
+        if links:
+            rows.set(row, 'links', links)
+            self._persist(table, {**rows.record(row), 'links': links})
+            self.serverLogger.logger.info(f"Server {self.server_id}: Removed link to deleted message {message_id} from {table} entry {rows.get(row, TABLES[table][0])}")
+        elif table == 'download':
+            self._delete_download_row(row)
+        else:
+            self._delete_video_row(row)
+        self.generation = next(generations)
+        return True
+
+    def _delete_download_row(self, row):
+        # Called with _lock held
+        id = self.downloads.get(row, 'id')
+        self.download_id_index.pop(id, None)
+        self._unindex_name(self.download_names_lower[row], row)
+        self.download_ids_lower[row] = ''
+        self.download_names_lower[row] = ''
+        self._unindex_messages('download', row)
+        self.downloads.delete(row)
+        self.deleted_rows['download'].add(row)
+        self._persist_delete('download', id)
+        self.serverLogger.logger.info(f"Server {self.server_id}: Removed link entry: ID={id}")
+
+    def _unindex_messages(self, table, row):
+        rows = self.downloads if table == 'download' else self.videos
+        index = self.message_rows[table]
+        for message_id in rows.get(row, 'links').values():
+            if index.get(message_id) == row:
+                del index[message_id]
+
+    def _delete_video_row(self, row):
+        # Called with _lock held
+        name = self.videos.get(row, 'name')
+        self._unindex_messages('video', row)
+        self.video_name_index.pop(name, None)
+        self.video_names_lower[row] = ''
+        self.videos.delete(row)
+        self.deleted_rows['video'].add(row)
+        self._persist_delete('video', name)
+        self.serverLogger.logger.info(f"Server {self.server_id}: Removed video entry: Name={name}")
+
+    def _reindex_name(self, old_key, new_key, row):
+        if old_key == new_key:
+            return
+        self._unindex_name(old_key, row)
+        self.download_name_index[new_key] = self.download_name_index.get(new_key, []) + [row]
+
+    def _unindex_name(self, key, row):
+        # The row lists are replaced instead of mutated, so snapshots can share them
+        rows = [other for other in self.download_name_index.get(key, ()) if other != row]
+        if rows:
+            self.download_name_index[key] = rows
+        else:
+            self.download_name_index.pop(key, None)
+
+    def _snapshot(self):
+        snapshot = self._current_snapshot
+        if snapshot is not None and snapshot.generation == self.generation:
+            return snapshot
+        with self._lock:
+            previous = self._current_snapshot
+            if previous is None or previous.generation != self.generation:
+                changed = {'download': self.downloads.changed, 'video': self.videos.changed}
+                self.downloads.changed, self.videos.changed = set(), set()
+                limit = max(SNAPSHOT_MIN_DELTA_ROWS, (len(self.downloads) + len(self.videos)) // SNAPSHOT_DELTA_SHARE)
+                if previous is None or previous.changed_rows + len(changed['download']) + len(changed['video']) > limit:
+                    self._current_snapshot = CatalogSnapshot(self)
+                else:
+                    self._current_snapshot = CatalogSnapshot(self, previous, changed)
+                if previous is not None:
+                    previous.release_shared()
+            return self._current_snapshot
+
+    def _column_scores(self, snapshot, column, scorer, query, percentage):
+        # Full column scans of big guilds go to the search pool, anything else is scored here
+        values = getattr(snapshot, column).values()
+        if search_pool.enabled_for(len(values)):
+            scores = search_pool.score(snapshot.shared_column(self.server_id, column), scorer, query, percentage)
+            if scores is not None:
+                return scores
+        return search.SCORERS[scorer](query, values, percentage)
 
     def get_download_entry(self, id):
-        entry = self.download_db[self.download_db['id'] == id]
-        return (entry['name'].iloc[0], entry['links'].iloc[0]) if not entry.empty else (None, None)
+        snapshot = self._snapshot()
+        row = snapshot.download_id_index.get(id)
+        if row is None:
+            return (None, None)
+        return (snapshot.downloads.get(row, 'name'), snapshot.downloads.get(row, 'links'))
 
     def get_video_entry(self, name):
-        entry = self.video_db[self.video_db['name'] == name]
-        return (entry['tag'].iloc[0], entry['links'].iloc[0]) if not entry.empty else None
+        snapshot = self._snapshot()
+        row = snapshot.video_name_index.get(name)
+        if row is None:
+            return None
+        return (snapshot.videos.get(row, 'tag'), snapshot.videos.get(row, 'links'))
 
     def get_download_ids(self, count):
-        return self.download_db['id'].tail(count).tolist()
+        snapshot = self._snapshot()
+        return _values(snapshot.downloads, 'id', _tail(snapshot.downloads, snapshot.deleted_rows['download'], count))
 
-    def get_matching_download_ids(self, count, query=None):
-        if query:
-            matched = self.download_db[self.download_db['id'].str.lower().str.contains(query.lower())]
-            return matched['id'].head(count).tolist()
+    def get_download_id_rows(self, query, rows=None, limit=None):
+        # Rows whose ID contains the query in row order, optionally only looking at the given
+        # rows. The scan stops after limit matches.
+        query = query.lower()
+        ids = self._snapshot().download_ids_lower
+        if rows is None:
+            matches = (row for row, id in enumerate(ids.values()) if query in id)
         else:
-            return self.download_db['id'].tail(count).tolist()
+            matches = (row for row in rows if row < len(ids) and query in ids[row])
+        return list(itertools.islice(matches, limit))
+
+    def get_latest_download_rows(self, count):
+        snapshot = self._snapshot()
+        return list(_tail(snapshot.downloads, snapshot.deleted_rows['download'], count))
+
+    def get_download_id_at(self, row):
+        return self._snapshot().downloads.get(row, 'id')
 
     def get_download_names(self, count, query=None, percentage=0):
+        snapshot = self._snapshot()
         if query:
-            matched = self.download_db.apply(lambda row: fuzz.ratio(query.lower(), row['name'].lower()), axis=1)
-            matched = self.download_db[matched >= percentage].sort_values(by='name', key=lambda x: matched[x.index], ascending=False)
-            return matched['name'].head(count).tolist()
+            scores = self._column_scores(snapshot, 'download_names_lower', 'ratio', query.lower(), percentage)
+            _drop_deleted(scores, snapshot.deleted_rows['download'])
+            return _values(snapshot.downloads, 'name', search.rank(scores, percentage, count))
         else:
-            return self.download_db['name'].tail(count).tolist()
+            return _values(snapshot.downloads, 'name', _tail(snapshot.downloads, snapshot.deleted_rows['download'], count))
         
     def get_download_id_names(self, count, query=None, percentage=0):
+        snapshot = self._snapshot()
         if not query:
-            result = self.download_db.tail(count)
-            return list(zip(result['id'], result['name']))
+            rows = _tail(snapshot.downloads, snapshot.deleted_rows['download'], count)
+            return list(zip(_values(snapshot.downloads, 'id', rows), _values(snapshot.downloads, 'name', rows)))
 
         query = query.lower()
 
-        def match_score(row):
-            name_score = fuzz.ratio(query, row['name'].lower())
-            id_score = 100 if query in row['id'].lower() else 0
-            return max(name_score, id_score)
+        scores = self._column_scores(snapshot, 'download_names_lower', 'ratio', query, percentage)
+        scores[search.substring_mask(query, snapshot.download_ids_lower)] = 100
+        _drop_deleted(scores, snapshot.deleted_rows['download'])
 
-        self.download_db['score'] = self.download_db.apply(match_score, axis=1)
-        matched = self.download_db[self.download_db['score'] >= percentage].sort_values(by='score', ascending=False)
-
-        result = matched.head(count)
-        return list(zip(result['id'], result['name']))
+        rows = search.rank(scores, percentage, count)
+        return list(zip(_values(snapshot.downloads, 'id', rows), _values(snapshot.downloads, 'name', rows)))
 
     def get_video_names(self, count, query=None, percentage=0):
+        snapshot = self._snapshot()
         if query:
-            matched = self.video_db.apply(lambda row: fuzz.ratio(query.lower(), row['name'].lower()), axis=1)
-            matched = self.video_db[matched >= percentage].sort_values(by='name', key=lambda x: matched[x.index], ascending=False)
-            return matched['name'].head(count).tolist()
+            scores = self._column_scores(snapshot, 'video_names_lower', 'ratio', query.lower(), percentage)
+            _drop_deleted(scores, snapshot.deleted_rows['video'])
+            return _values(snapshot.videos, 'name', search.rank(scores, percentage, count))
         else:
-            return self.video_db['name'].tail(count).tolist()
+            return _values(snapshot.videos, 'name', _tail(snapshot.videos, snapshot.deleted_rows['video'], count))
 
     def get_matching_videos(self, count, query=None, percentage=50):
+        snapshot = self._snapshot()
         if not query:
-            return self.video_db.tail(count).to_dict('records')
+            return snapshot.videos.records(_tail(snapshot.videos, snapshot.deleted_rows['video'], count))
 
         query = query.lower()
 
-        def match_score(row):
-            name = row['name'].lower()
-            
-            if query in name:
-                return 100
-            
-            name_score = fuzz.partial_ratio(query, name)
-            return name_score
+        scores = self._column_scores(snapshot, 'video_names_lower', 'partial_ratio', query, percentage)
+        scores[search.substring_mask(query, snapshot.video_names_lower)] = 100
+        _drop_deleted(scores, snapshot.deleted_rows['video'])
 
-        matched = self.video_db.apply(match_score, axis=1)
-        matched = self.video_db[matched >= percentage].sort_values(by='name', key=lambda x: matched[x.index], ascending=False)
-        return matched.head(count).to_dict('records')
+        return snapshot.videos.records(search.rank(scores, percentage, count))
 
     def get_matching_downloads(self, count, query=None, percentage=50):
+        import numpy as np
+
+        snapshot = self._snapshot()
         if not query:
-            return self.download_db.tail(count).to_dict('records')
+            return snapshot.downloads.records(_tail(snapshot.downloads, snapshot.deleted_rows['download'], count))
 
         query = query.lower().strip()
 
-        def match_score(row):
-            name = row['name'].lower()
-            id = str(row['id']).lower()
-            
-            if query == name or query == id:
-                return 200 
-            
-            if query in name or query in id:
-                return 100
-            
-            name_score = fuzz.ratio(query, name)
-            id_score = fuzz.ratio(query, id)
-            return max(name_score, id_score)
-
-        self.download_db['score'] = self.download_db.apply(match_score, axis=1)
-        matched = self.download_db[self.download_db['score'] >= percentage].sort_values(by='score', ascending=False)
-        
-        exact_matches = matched[matched['score'] == 200]
-        if not exact_matches.empty:
-            return exact_matches.head(1).to_dict('records')
-        
-        return matched.head(count).to_dict('records')
-
-# Dictionary to store database instances for each server
-server_databases = {}
+        # Exact ID or name hits short-circuit the fuzzy scan
+        exact_rows = snapshot.download_name_index.get(query)
+        exact_row = snapshot.download_id_index.get(query.upper(), exact_rows[0] if exact_rows else None)
+        if exact_row is not None:
+            return snapshot.downloads.records([exact_row])
+
+        scores = self._column_scores(snapshot, 'download_names_lower', 'ratio', query, percentage)
+        scores = np.maximum(scores, self._column_scores(snapshot, 'download_ids_lower', 'ratio', query, percentage))
+        scores[search.substring_mask(query, snapshot.download_names_lower)] = 100
+        scores[search.substring_mask(query, snapshot.download_ids_lower)] = 100
+        _drop_deleted(scores, snapshot.deleted_rows['download'])
+
+        return snapshot.downloads.records(search.rank(scores, percentage, count))
+
+    def get_latest_message_ids(self, table, before=None):
+        # channel ID -> newest message ID stored for it (older than before, if given), for scans
+        # of channels without a checkpoint
+        snapshot = self._snapshot()
+        rows = snapshot.downloads if table == 'download' else snapshot.videos
+        latest = {}
+        for encoded in rows.column('links'):
+            for channel_id, message_id in decode_links(encoded).items():
+                if message_id > latest.get(channel_id, 0) and (before is None or message_id < before):
+                    latest[channel_id] = message_id
+        return latest
+
+def _values(table, column, rows):
+    values = table.column(column)
+    return [values[row] for row in rows]
+
+def _tail(table, deleted, count):
+    # Like CatalogTable.tail, skipping deleted rows
+    if not deleted:
+        return table.tail(count)
+    rows = []
+    row = len(table) - 1
+    while row >= 0 and len(rows) < count:
+        if row not in deleted:
+            rows.append(row)
+        row -= 1
+    return rows[::-1]
+
+def _drop_deleted(scores, deleted):
+    # Scores below every cutoff, so search.rank never returns a deleted row
+    if deleted:
+        scores[list(deleted)] = -1
+
+class ColumnSnapshot:
+    # One column at a snapshot: the copy taken by the last full snapshot and the rows written
+    # since. Rows are read through the overlay, the whole column is only built for full scans.
+    __slots__ = ('base', 'changed', 'size', '_values')
+
+    def __init__(self, base, changed=None, size=None):
+        self.base = base
+        self.changed = changed or {}
+        self.size = len(base) if size is None else size
+        self._values = None if self.changed else base
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if row in self.changed:
+            return self.changed[row]
+        return self.base[row]
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def values(self):
+        values = self._values
+        if values is None:
+            values = list(self.base)
+            values.extend([''] * (self.size - len(values)))
+            for row, value in self.changed.items():
+                values[row] = value
+            self._values = values
+        return values
+
+    def updated(self, column, rows):
+        return ColumnSnapshot(self.base, {**self.changed, **{row: column[row] for row in rows}}, len(column))
+
+class IndexSnapshot:
+    # An index at a snapshot: the copy taken by the last full snapshot and the current value,
+    # None when removed, of every key that changed since
+    __slots__ = ('base', 'changed')
+
+    def __init__(self, base, changed=None):
+        self.base = base
+        self.changed = changed or {}
+
+    def get(self, key, default=None):
+        value = self.changed[key] if key in self.changed else self.base.get(key)
+        return default if value is None else value
+
+    def updated(self, index, keys):
+        return IndexSnapshot(self.base, {**self.changed, **{key: index.get(key) for key in keys}})
+
+class CatalogSnapshot:
+    # The searchable state at one generation. Searches run against a snapshot without holding
+    # the write lock, so they never wait on an ingest or scan in progress. The first snapshot
+    # copies the state, the ones after it share those copies and only carry the rows changed
+    # since, until so many changed that copying everything again is cheaper.
+    __slots__ = (
+        'generation', 'downloads', 'videos',
+        'download_id_index', 'download_name_index', 'video_name_index',
+        'download_ids_lower', 'download_names_lower', 'video_names_lower',
+        'deleted_rows', 'shared', '_shared_lock',
+    )
+
+    def __init__(self, db, previous=None, changed=None):
+        self.generation = db.generation
+        if previous is None:
+            self.downloads = _table_snapshot(db.downloads.copy())
+            self.videos = _table_snapshot(db.videos.copy())
+            self.download_id_index = IndexSnapshot(db.download_id_index.copy())
+            self.download_name_index = IndexSnapshot(db.download_name_index.copy())
+            self.video_name_index = IndexSnapshot(db.video_name_index.copy())
+            self.download_ids_lower = ColumnSnapshot(db.download_ids_lower.copy())
+            self.download_names_lower = ColumnSnapshot(db.download_names_lower.copy())
+            self.video_names_lower = ColumnSnapshot(db.video_names_lower.copy())
+            self.deleted_rows = {table: frozenset(rows) for table, rows in db.deleted_rows.items()}
+        else:
+            downloads, videos = changed['download'], changed['video']
+            # Keys the changed rows had in the previous snapshot and have now
+            id_keys = {previous.downloads.get(row, 'id') for row in downloads if row < len(previous.downloads)}
+            id_keys.update(db.downloads.get(row, 'id') for row in downloads)
+            name_keys = {previous.download_names_lower[row] for row in downloads if row < len(previous.downloads)}
+            name_keys.update(db.download_names_lower[row] for row in downloads)
+            video_keys = {previous.videos.get(row, 'name') for row in videos if row < len(previous.videos)}
+            video_keys.update(db.videos.get(row, 'name') for row in videos)
+
+            self.downloads = _updated_table(previous.downloads, db.downloads, downloads)
+            self.videos = _updated_table(previous.videos, db.videos, videos)
+            self.download_id_index = previous.download_id_index.updated(db.download_id_index, id_keys)
+            self.download_name_index = previous.download_name_index.updated(db.download_name_index, name_keys)
+            self.video_name_index = previous.video_name_index.updated(db.video_name_index, video_keys)
+            self.download_ids_lower = previous.download_ids_lower.updated(db.download_ids_lower, downloads)
+            self.download_names_lower = previous.download_names_lower.updated(db.download_names_lower, downloads)
+            self.video_names_lower = previous.video_names_lower.updated(db.video_names_lower, videos)
+            self.deleted_rows = {}
+            for table, rows in changed.items():
+                deleted = rows & db.deleted_rows[table]
+                self.deleted_rows[table] = previous.deleted_rows[table] | deleted if deleted else previous.deleted_rows[table]
+        # Search columns published to the search pool, created on first use
+        self.shared = {}
+        self._shared_lock = threading.Lock()
+
+    @property
+    def changed_rows(self):
+        # Rows that differ from the last full copy
+        return len(self.downloads.data['id'].changed) + len(self.videos.data['name'].changed)
+
+    def shared_column(self, server_id, column):
+        with self._shared_lock:
+            shared = self.shared.get(column)
+            if shared is None:
+                shared = self.shared[column] = SharedColumn((server_id, column), self.generation, getattr(self, column).values())
+            return shared
+
+    def release_shared(self):
+        with self._shared_lock:
+            for shared in self.shared.values():
+                shared.release()
+            self.shared.clear()
+
+def _table_snapshot(table):
+    return CatalogTable(table.columns, {column: ColumnSnapshot(values) for column, values in table.data.items()})
+
+def _updated_table(snapshot, table, rows):
+    return CatalogTable(table.columns, {column: snapshot.data[column].updated(values, rows) for column, values in table.data.items()})
+
+def _unload_database(db):
+    db.close()
+    db.serverLogger.logger.info(f"Server {db.server_id}: Unloaded database ({server_databases.stats()})")
+
+# Database instances for each server. Loading and evicting happen on the database pool, the
+# eviction flushes pending writes before the guild can be loaded again.
+server_databases = GuildCache(
+    load=ServerDatabase,
+    close=_unload_database,
+    size_of=ServerDatabase.memory_estimate,
+    max_bytes=GUILD_CACHE_MAX_MB * 1024 * 1024,
+    idle_ttl=GUILD_IDLE_TTL,
+)
 
 def get_server_database(server_id):
     if not server_id:
         raise commands.NoPrivateMessage("This command cannot be used in private messages.")
-    if server_id not in server_databases:
-        server_databases[server_id] = ServerDatabase(server_id)
-    return server_databases[server_id]
+    return server_databases.get(server_id)
+
+async def get_server_database_async(server_id):
+    db = server_databases.peek(server_id)
+    if db is not None:
+        if server_databases.sweep_due():
+            db_executor.submit(server_databases.evict)
+        return db
+    return await run_in_db_pool(get_server_database, server_id)
+
+def flush_all_databases():
+    server_databases.clear()
+
+atexit.register(flush_all_databases)
+atexit.register(search_pool.close)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds between idle sweeps that are not triggered by a load
+SWEEP_INTERVAL = 60
+
+class GuildCache:
+    # Bounded LRU of per-guild state. Entries are loaded on first access and evicted once they
+    # have been idle for idle_ttl seconds, when there are more than max_entries of them, or when
+    # their combined size_of() goes over max_bytes. Evicted entries are closed and load again on
+    # their next access. A limit of 0 disables it.
+    def __init__(self, load, close=None, size_of=None, max_entries=0, max_bytes=0, idle_ttl=0):
+        self.load = load
+        self.close = close
+        self.size_of = size_of
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+
+        # server_id -> value, least recently used first
+        self.entries = OrderedDict()
+        self.last_used = {}
+        self._lock = threading.RLock()
+        # Held while a guild is loaded or evicted, so a guild is never loaded twice and never
+        # reloaded before its eviction has finished
+        self._key_locks = {}
+        self._last_sweep = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key_lock(self, server_id):
+        with self._lock:
+            return self._key_locks.setdefault(server_id, threading.Lock())
+
+    def _touch(self, server_id):
+        self.entries.move_to_end(server_id)
+        self.last_used[server_id] = time.monotonic()
+
+    def peek(self, server_id):
+        # The cached value or None, never loads or evicts
+        with self._lock:
+            value = self.entries.get(server_id)
+            if value is not None:
+                self._touch(server_id)
+                self.hits += 1
+            return value
+
+    def get(self, server_id):
+        value = self.peek(server_id)
+        if value is not None:
+            self.evict_if_due()
+            return value
+
+        with self._key_lock(server_id):
+            with self._lock:
+                value = self.entries.get(server_id)
+            if value is None:
+                value = self.load(server_id)
+                with self._lock:
+                    self.misses += 1
+                    self.entries[server_id] = value
+                    self._touch(server_id)
+
+        self.evict()
+        return value
+
+    def put(self, server_id, value):
+        with self._lock:
+            self.entries[server_id] = value
+            self._touch(server_id)
+
+    def full(self):
+        with self._lock:
+            if self.max_entries and len(self.entries) >= self.max_entries:
+                return True
+            return bool(self.max_bytes and self.size_of and self._total_size() >= self.max_bytes)
+
+    def _total_size(self):
+        return sum(self.size_of(value) for value in self.entries.values())
+
+    def sweep_due(self):
+        return time.monotonic() - self._last_sweep >= SWEEP_INTERVAL
+
+    def evict_if_due(self):
+        if self.sweep_due():
+            self.evict()
+
+    def evict(self):
+        now = time.monotonic()
+        self._last_sweep = now
+
+        with self._lock:
+            sizes = {server_id: self.size_of(value) for server_id, value in self.entries.items()} if self.max_bytes and self.size_of else {}
+            total = sum(sizes.values())
+            count = len(self.entries)
+            victims = []
+            for server_id in self.entries:
+                idle = self.idle_ttl and now - self.last_used[server_id] >= self.idle_ttl
+                over = (self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes)
+                # The most recently used entry is never evicted for size, it was just asked for
+                if not idle and (not over or count == 1):
+                    break
+                victims.append(server_id)
+                count -= 1
+                total -= sizes.get(server_id, 0)
+
+        for server_id in victims:
+            with self._key_lock(server_id):
+                with self._lock:
+                    value = self.entries.pop(server_id, None)
+                    self.last_used.pop(server_id, None)
+                if value is None:
+                    continue
+                if self.close is not None:
+                    self.close(value)
+                with self._lock:
+                    self.evictions += 1
+        return len(victims)
+
+    def clear(self):
+        for server_id in list(self.entries):
+            with self._key_lock(server_id):
+                with self._lock:
+                    value = self.entries.pop(server_id, None)
+                    self.last_used.pop(server_id, None)
+                if value is not None and self.close is not None:
+                    self.close(value)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from core.checkpoints import get_scan_checkpoints
+from core.config import INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, SCAN_PARSE_WORKERS
+from core.database import get_server_database_async, run_in_db_pool
+from core.logger import get_server_logger
+from core.matcher import get_download_matcher
+from core.titles import UNKNOWN_TITLES, pending_titles
+from core.utils import parse_download_message, parse_video_message
+
+# Live ingest. on_message and the raw edit and delete events put their work in a per-guild
+# queue instead of writing to the database themselves. One worker per guild takes whatever
+# has queued up, up to INGEST_BATCH_SIZE items, parses the messages on the database pool and
+# stores them in one batch, in the order they arrived. Edits and deletes go through the same
+# queue, so they never overtake the post they change. A full queue makes the event handlers
+# wait until the worker has caught up.
+
+class GuildIngest:
+    def __init__(self, server_id):
+        self.server_id = server_id
+        # (queued at, message, kinds) for new messages, (queued at, coroutine function, args) for edits and deletes
+        self.queue = asyncio.Queue(INGEST_QUEUE_SIZE)
+        self.worker = None
+
+        self.processed = 0
+        self.batches = 0
+        # Seconds from queueing to stored, of the oldest item in the last batch and the most so far
+        self.last_lag = 0
+        self.max_lag = 0
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    async def add_message(self, message, kinds):
+        await self._put((time.monotonic(), message, kinds))
+
+    async def add_call(self, func, *args):
+        await self._put((time.monotonic(), func, args))
+
+    async def _put(self, item):
+        if self.queue.full():
+            get_server_logger(self.server_id).logger.warning(f"Server {self.server_id}: Ingest queue is full ({self.depth} items), waiting for the worker")
+        await self.queue.put(item)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Exits once the queue is empty, the next item starts a new worker
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < INGEST_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Runs of new messages are stored together, edits and deletes one by one in between
+            start = 0
+            while start < len(batch):
+                end = start
+                if callable(batch[start][1]):
+                    await self._call(batch[start])
+                    end += 1
+                else:
+                    while end < len(batch) and not callable(batch[end][1]):
+                        end += 1
+                    await self._store(batch[start:end])
+                start = end
+
+            self.last_lag = time.monotonic() - batch[0][0]
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self.processed += len(batch)
+            self.batches += 1
+            if len(batch) > 1:
+                get_server_logger(self.server_id).logger.info(f"Server {self.server_id}: Ingested {len(batch)} items in one batch ({self.stats()})")
+
+    async def _call(self, item):
+        _, func, args = item
+        try:
+            await func(*args)
+        except Exception as e:
+            get_server_logger(self.server_id).logger.error(f"Server {self.server_id}: {func.__name__} failed: {e}")
+
+    async def _store(self, items):
+        serverLogger = get_server_logger(self.server_id)
+        try:
+            matcher = get_download_matcher(self.server_id)
+            # Bigger runs are split over the parse workers, the results keep the message order
+            size = max(1, -(-len(items) // SCAN_PARSE_WORKERS))
+            chunks = [items[i:i + size] for i in range(0, len(items), size)]
+            results = await asyncio.gather(*(run_in_db_pool(_parse_messages, chunk, matcher) for chunk in chunks))
+
+            downloads, videos = [], []
+            for chunk in results:
+                for message, kind, parsed in chunk:
+                    if kind == 'download':
+                        id, name = parsed
+                        downloads.append((id, name or UNKNOWN_TITLES['download'], message.channel.id, message.id))
+                    else:
+                        name, tag, url = parsed
+                        # The URL is a placeholder name that is unique to the video, so the title can replace it
+                        videos.append((name or url, message.channel.id, message.id, tag))
+
+            db = await get_server_database_async(self.server_id)
+            if downloads:
+                await db.aio.update_download_entries(downloads, wait=False)
+            if videos:
+                await db.aio.update_video_entries(videos, wait=False)
+
+            # Stored under the placeholder right away, the title follows with the embed
+            for chunk in results:
+                for message, kind, parsed in chunk:
+                    if kind == 'download' and parsed[1] is None:
+                        pending_titles.add(message, 'download', parsed[0])
+                    elif kind == 'video' and parsed[0] is None:
+                        pending_titles.add(message, 'video', parsed[2], parsed[1])
+        except Exception as e:
+            serverLogger.logger.error(f"Server {self.server_id}: Storing {len(items)} messages failed: {e}")
+            return
+
+        checkpoints = get_scan_checkpoints(self.server_id)
+        for _, message, kinds in items:
+            for kind in kinds:
+                checkpoints.advance_live(kind, message.channel.id, message.id)
+
+    def stats(self):
+        return f"{self.depth} queued, lag {self.last_lag * 1000:.0f} ms (max {self.max_lag * 1000:.0f} ms), {self.processed} processed in {self.batches} batches"
+
+def _parse_messages(items, matcher):
+    # Runs on the database pool: (message, kind, parsed) for every post, in message order
+    parsed_messages = []
+    for _, message, kinds in items:
+        for kind in kinds:
+            parsed = parse_download_message(message, matcher) if kind == 'download' else parse_video_message(message)
+            if parsed:
+                parsed_messages.append((message, kind, parsed))
+    return parsed_messages
+
+# server_id -> GuildIngest, an idle one is only its counters
+ingest_queues = {}
+
+def get_ingest(server_id):
+    ingest = ingest_queues.get(server_id)
+    if ingest is None:
+        ingest = ingest_queues[server_id] = GuildIngest(server_id)
+    return ingest
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+# Append-only log of upserts, one JSON record per line. A record only counts once its
+# trailing newline is written, so a write cut off by a killed process is dropped on replay
+# and cut from the file, where the next append would otherwise continue the broken line.
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.old_path = path + '.old'
+        self.record_count = 0
+        self._file = None
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._file.flush()
+        self.record_count += len(records)
+
+    def replay(self):
+        # A leftover .old file means a compaction was interrupted, its records come first
+        records = self._read(self.old_path) + self._read(self.path)
+        self.record_count = len(records)
+        return records
+
+    def rotate(self):
+        # Moves the current journal aside so a compaction can fold it into the snapshot
+        # while new upserts keep going to a fresh file
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.old_path):
+                # Left by a compaction that failed, its records stay ahead of the newer ones
+                with open(self.old_path, 'ab') as old, open(self.path, 'rb') as f:
+                    shutil.copyfileobj(f, old)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.old_path)
+        self.record_count = 0
+
+    def discard_old(self):
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def clear(self):
+        self.close()
+        self.discard_old()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.record_count = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read(self, path):
+        records = []
+        if not os.path.exists(path):
+            return records
+
+        complete = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                complete += len(line)
+
+        if complete < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(complete)
+        return records
+
+def write_atomic(file_path, write, binary=False):
+    # Write to a temp file and swap it in, so readers never see a half written file
+    tmp_path = file_path + '.tmp'
+    with (open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf-8', newline='')) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import os
 import inspect
@@ -6,6 +5,9 @@ from functools import wraps
 from logging.handlers import RotatingFileHandler
 from discord.ext import commands
 
+from core.config import GUILD_IDLE_TTL, MAX_OPEN_LOGS
+from core.guild_cache import GuildCache
+
 class ServerLogger:
     def __init__(self, server_id):
         self.server_id = server_id
@@ -33,6 +35,12 @@ class ServerLogger:
 
         return logger
 
+    def close(self):
+        # The logging module keeps the logger itself, a reloaded ServerLogger adds a new handler to it
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
     def log_command(self, ctx, command_name, params, result):
         user = ctx.author
         guild = ctx.guild
@@ -55,29 +63,83 @@ class ServerLogger:
 
         self.logger.info(log_message)
 
-# Dictionary to store logger instances for each server
-server_loggers = {}
+# Logger instances for each server, each one keeps its log file open
+server_loggers = GuildCache(load=ServerLogger, close=ServerLogger.close, max_entries=MAX_OPEN_LOGS, idle_ttl=GUILD_IDLE_TTL)
 
 def get_server_logger(server_id):
     if not server_id:
         raise commands.NoPrivateMessage("This command cannot be used in private messages.")
-    if server_id not in server_loggers:
-        server_loggers[server_id] = ServerLogger(server_id)
-    return server_loggers[server_id]
+    return server_loggers.get(server_id)
+
+def _describe_message(args, kwargs):
+    embed = kwargs.get('embed') or next(iter(kwargs.get('embeds') or ()), None)
+    if embed is not None:
+        return f"Embed: {embed.title}"
+    return args[0] if args else kwargs.get('content')
+
+class _RecordingFollowup:
+    def __init__(self, followup, recorder):
+        self._followup = followup
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._followup, name)
+
+    async def send(self, *args, **kwargs):
+        message = await self._followup.send(*args, **kwargs)
+        self._recorder.record(args, kwargs)
+        return message
+
+class ResponseRecorder:
+    # Passed to the command instead of its ApplicationContext and remembers the first message
+    # the command sent, so the log line needs no extra request. respond and followup are
+    # properties of the context in py-cord and cannot be wrapped on the context itself.
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self.response = None
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    def record(self, args, kwargs):
+        if self.response is None:
+            self.response = _describe_message(args, kwargs)
+
+    @property
+    def followup(self):
+        return _RecordingFollowup(self._ctx.followup, self)
+
+    async def respond(self, *args, **kwargs):
+        message = await self._ctx.respond(*args, **kwargs)
+        self.record(args, kwargs)
+        return message
+
+    async def send_response(self, *args, **kwargs):
+        message = await self._ctx.send_response(*args, **kwargs)
+        self.record(args, kwargs)
+        return message
+
+    async def send_followup(self, *args, **kwargs):
+        message = await self._ctx.send_followup(*args, **kwargs)
+        self.record(args, kwargs)
+        return message
 
 def command_logger(func):
+    sig = inspect.signature(func)
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
         ctx = next((arg for arg in args if hasattr(arg, 'command')), None)
         if ctx is None:
             return await func(*args, **kwargs)
+        recorder = ResponseRecorder(ctx)
+        args = tuple(recorder if arg is ctx else arg for arg in args)
 
         server_id = ctx.guild.id
         logger = get_server_logger(server_id)
 
         command_name = ctx.command.name
         
-        sig = inspect.signature(func)
         bound_args = sig.bind(*args, **kwargs)
         bound_args.apply_defaults()
         params = dict(bound_args.arguments)
@@ -87,24 +149,8 @@ def command_logger(func):
         
         try:
             result = await func(*args, **kwargs)
-
-            try:
-                await asyncio.sleep(0.1)
-                
-                if ctx.interaction.response.is_done():
-                    response_message = await ctx.interaction.original_response()
-                    
-                    if response_message.embeds:
-                        response_content = f"Embed: {response_message.embeds[0].title}"
-                    else:
-                        response_content = response_message.content
-                else:
-                    response_content = "No response sent"
-
-                logger.log_command(ctx, command_name, params, f"Success: {response_content}")
-            except Exception as e:
-                logger.log_command(ctx, command_name, params, f"Success: Unable to retrieve response content. Error: {str(e)}")
-            
+            response_content = recorder.response if recorder.response is not None else "No response sent"
+            logger.log_command(ctx, command_name, params, f"Success: {response_content}")
             return result
         except Exception as e:
             logger.log_command(ctx, command_name, params, f"Error: {str(e)}")
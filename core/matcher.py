@@ -0,0 +1,62 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from core.config import load_config
+
+# Compiled ingest patterns. The download pattern comes from the guild's search_regex and is
+# compiled once per guild, together with a literal that every match has to contain. Checking
+# that literal with `in` rejects most messages without running the regex.
+
+DEFAULT_SEARCH_REGEX = 'DN : (.+)'
+
+DOWNLOAD_LINK = re.compile(r'Link : (https?://\S+)')
+DOWNLOAD_LINK_LITERAL = 'Link : '
+YOUTUBE_LINK = re.compile(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
+YOUTUBE_LITERAL = 'youtu'
+ROLE_TAG = re.compile(r'<@&(\d+)>')
+ROLE_TAG_LITERAL = '<@&'
+
+def required_literal(pattern):
+    # The longest run of plain characters at the top level of the pattern, which every match
+    # contains. None when there is none or the pattern ignores case.
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    best, run = '', []
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(value))
+            continue
+        if len(run) > len(best):
+            best = ''.join(run)
+        run = []
+    if len(run) > len(best):
+        best = ''.join(run)
+    return best or None
+
+class DownloadMatcher:
+    __slots__ = ('search_regex', 'pattern', 'literal')
+
+    def __init__(self, search_regex):
+        self.search_regex = search_regex
+        self.pattern = re.compile(search_regex)
+        self.literal = required_literal(self.pattern)
+
+# server_id -> DownloadMatcher of the guild's current search_regex
+download_matchers = {}
+
+def get_download_matcher(server_id):
+    # Only compiled again after save_config stored a different search_regex
+    search_regex = load_config(server_id).get('search_regex', DEFAULT_SEARCH_REGEX)
+    matcher = download_matchers.get(server_id)
+    if matcher is None or matcher.search_regex != search_regex:
+        matcher = download_matchers[server_id] = DownloadMatcher(search_regex)
+    return matcher
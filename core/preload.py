@@ -0,0 +1,64 @@
+import asyncio
+import os
+import time
+
+from core.config import DATA_DIR, PRELOAD_CONCURRENCY, load_policy
+from core.database import get_server_database, run_in_db_pool, server_databases
+from core.logger import get_server_logger
+from core import search
+
+# Background warm-up after on_ready: configs, databases and search snapshots of every guild
+# are loaded on the database pool, at most PRELOAD_CONCURRENCY guilds at a time, most active
+# guilds first. Commands for a guild that is not warm yet load it on demand, and when a
+# command and the warm-up want the same guild only one of them loads it.
+
+def _last_activity(server_id):
+    # Commands are logged and catalog changes journaled in the guild's data directory, so
+    # its most recently modified file tells how recently the guild was used
+    server_dir = os.path.join(DATA_DIR, str(server_id))
+    try:
+        return max(os.path.getmtime(os.path.join(server_dir, name)) for name in os.listdir(server_dir))
+    except (OSError, ValueError):
+        return 0
+
+def _preload_order(guilds):
+    activity = {guild.id: _last_activity(guild.id) for guild in guilds}
+    return sorted(guilds, key=lambda guild: (activity[guild.id], guild.member_count or 0), reverse=True)
+
+def _preload_guild(server_id):
+    serverLogger = get_server_logger(server_id)
+    load_policy(server_id)
+    # Once the database memory ceiling is reached the remaining, less active guilds would only
+    # push out the ones loaded before them
+    if not server_databases.full():
+        get_server_database(server_id)._snapshot()
+    return serverLogger
+
+async def preload_guilds(guilds):
+    started_at = time.perf_counter()
+    guilds = await run_in_db_pool(_preload_order, guilds)
+    total = len(guilds)
+    done = 0
+    reported = 0
+    semaphore = asyncio.Semaphore(PRELOAD_CONCURRENCY)
+
+    # The search libraries are imported lazily, load them before the first search needs them
+    await run_in_db_pool(search.load_dependencies)
+
+    async def preload(guild):
+        nonlocal done, reported
+        async with semaphore:
+            try:
+                serverLogger = await run_in_db_pool(_preload_guild, guild.id)
+                serverLogger.logger.info(f'Bot is ready in guild: {guild.name} (ID: {guild.id})')
+            except Exception as e:
+                get_server_logger(guild.id).logger.error(f'Preloading guild {guild.name} (ID: {guild.id}) failed: {e}')
+                print(f'Preloading guild {guild.name} (ID: {guild.id}) failed: {e}')
+
+        # Progress is reported in steps of 10%
+        done += 1
+        if done * 10 // total > reported:
+            reported = done * 10 // total
+            print(f'Preloaded {done}/{total} guilds ({time.perf_counter() - started_at:.1f}s)')
+
+    await asyncio.gather(*(preload(guild) for guild in guilds))
@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+import time
+import discord
+
+from core.checkpoints import get_scan_checkpoints, held_channels
+from core.config import (
+    SCAN_MAX_CONCURRENT, SCAN_MAX_PER_GUILD, SCAN_REQUESTS_PER_SECOND, SCAN_PROGRESS_INTERVAL, load_config,
+)
+from core.database import get_server_database_async
+from core.logger import get_server_logger
+from core.utils import scan_channel_history
+
+# Scan job queue. /config scans and the catch-up after a restart submit jobs instead of
+# scanning inside the command, the scheduler runs them within the global and per-guild
+# limits and all of them share one pacer for their history requests.
+
+# A history request that takes this long was most likely held back by the REST rate limit
+SLOW_REQUEST = 1.5
+# The pacer never slows down to more than this many seconds between requests
+MAX_REQUEST_INTERVAL = 10
+
+_job_ids = itertools.count(1)
+
+class RequestPacer:
+    # Spaces out the history requests of all scans to SCAN_REQUESTS_PER_SECOND, which leaves
+    # the rest of the REST rate limit to commands. Requests that come back slowly double the
+    # spacing, fast ones bring it back down step by step.
+    def __init__(self, requests_per_second):
+        self.base_interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.interval = self.base_interval
+        self._next_request = 0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_request)
+        self._next_request = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def record(self, seconds):
+        if not self.base_interval:
+            return
+        if seconds >= SLOW_REQUEST:
+            self.interval = min(self.interval * 2, MAX_REQUEST_INTERVAL)
+        else:
+            self.interval = max(self.base_interval, self.interval * 0.9)
+
+class ScanJob:
+    def __init__(self, server_id, kind, channel):
+        self.id = next(_job_ids)
+        self.server_id = server_id
+        self.kind = kind
+        self.channel = channel
+        self.status = 'queued'
+        self.processed = 0
+        self.resumed = False
+        self.error = None
+        self.started_at = None
+        self.elapsed = 0
+        self.task = None
+        self.reporter = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def rate(self):
+        elapsed = self.elapsed if not self.active else (time.perf_counter() - self.started_at if self.started_at else 0)
+        return self.processed / elapsed if elapsed else 0
+
+    def describe(self):
+        name = f"{'Video scan' if self.kind == 'video' else 'Scan'} of <#{self.channel.id}>"
+        new = " new" if self.resumed else ""
+        if self.status == 'queued':
+            return f"⏳ {name}: queued"
+        if self.status == 'running':
+            return f"🔍 {name}: **{self.processed}** messages so far ({self.rate():.0f} msgs/sec)"
+        if self.status == 'done':
+            return f"✅ {name}: processed **{self.processed}**{new} messages in {self.elapsed:.1f}s ({self.rate():.0f} msgs/sec)"
+        if self.status == 'cancelled':
+            return f"⏹️ {name}: cancelled after **{self.processed}** messages"
+        return f"❌ {name}: **An error occurred**: {self.error}"
+
+class ProgressMessage:
+    # One followup message that shows the progress of the jobs a command started. Edits are
+    # throttled to SCAN_PROGRESS_INTERVAL, only the final state is always written.
+    def __init__(self, ctx, jobs):
+        self.ctx = ctx
+        self.jobs = jobs
+        self.message = None
+        self._last_edit = 0
+        self._lock = asyncio.Lock()
+        for job in jobs:
+            job.reporter = self
+
+    def render(self):
+        return "\n".join(job.describe() for job in self.jobs)
+
+    async def send(self):
+        self._last_edit = time.monotonic()
+        self.message = await self.ctx.followup.send(self.render(), ephemeral=True, wait=True)
+
+    async def update(self, force=False):
+        if self.message is None:
+            return
+        if not force and time.monotonic() - self._last_edit < SCAN_PROGRESS_INTERVAL:
+            return
+        async with self._lock:
+            self._last_edit = time.monotonic()
+            try:
+                await self.message.edit(content=self.render())
+            except discord.HTTPException:
+                # The interaction token runs out after 15 minutes, the scan itself goes on
+                self.message = None
+
+class ScanScheduler:
+    def __init__(self, max_concurrent, max_per_guild, requests_per_second):
+        self.max_concurrent = max_concurrent
+        self.max_per_guild = max_per_guild
+        self.pacer = RequestPacer(requests_per_second)
+        # Jobs waiting to run, in the order they were submitted
+        self.queue = []
+        self.running = {}
+
+    def submit(self, server_id, kind, channel):
+        # A channel that is already queued or scanning keeps its job
+        for job in self.jobs(server_id):
+            if job.kind == kind and job.channel.id == channel.id:
+                return job
+        job = ScanJob(server_id, kind, channel)
+        # Live messages leave the checkpoint to the scan from now on, not only once it runs
+        held_channels.add((server_id, kind, channel.id))
+        self.queue.append(job)
+        self._start_jobs()
+        return job
+
+    def jobs(self, server_id):
+        running = [job for job in self.running.values() if job.server_id == server_id]
+        return running + [job for job in self.queue if job.server_id == server_id]
+
+    def cancel(self, server_id, channel_id=None):
+        cancelled = []
+        for job in self.jobs(server_id):
+            if channel_id is not None and job.channel.id != channel_id:
+                continue
+            if job.status == 'queued':
+                self.queue.remove(job)
+                held_channels.discard((job.server_id, job.kind, job.channel.id))
+                job.status = 'cancelled'
+                if job.reporter is not None:
+                    asyncio.create_task(job.reporter.update(force=True))
+            else:
+                job.task.cancel()
+            cancelled.append(job)
+        return cancelled
+
+    def _start_jobs(self):
+        for job in list(self.queue):
+            if self.max_concurrent and len(self.running) >= self.max_concurrent:
+                break
+            if self.max_per_guild and sum(running.server_id == job.server_id for running in self.running.values()) >= self.max_per_guild:
+                continue
+            self.queue.remove(job)
+            self.running[job.id] = job
+            job.status = 'running'
+            job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        serverLogger = get_server_logger(job.server_id)
+        job.started_at = time.perf_counter()
+
+        async def progress(processed):
+            job.processed = processed
+            if job.reporter is not None:
+                await job.reporter.update()
+
+        try:
+            job.processed, job.resumed, job.elapsed = await scan_channel_history(
+                job.server_id, job.kind, job.channel, pacer=self.pacer, progress=progress
+            )
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            serverLogger.logger.info(f"Cancelled {job.kind} scan of channel {job.channel.name} after {job.processed} messages")
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            serverLogger.logger.error(f"An error occurred while scanning {job.kind} channel {job.channel.name}: {e}")
+        finally:
+            held_channels.discard((job.server_id, job.kind, job.channel.id))
+            job.elapsed = job.elapsed or time.perf_counter() - job.started_at
+            self.running.pop(job.id, None)
+            self._start_jobs()
+
+        if job.reporter is not None:
+            await job.reporter.update(force=True)
+
+scan_scheduler = ScanScheduler(SCAN_MAX_CONCURRENT, SCAN_MAX_PER_GUILD, SCAN_REQUESTS_PER_SECOND)
+
+async def start_scans(ctx, kind, channels):
+    # Queues scans of the channels and reports their progress in one followup message
+    jobs = [scan_scheduler.submit(ctx.guild.id, kind, channel) for channel in channels]
+    reporter = ProgressMessage(ctx, jobs)
+    await reporter.send()
+    return jobs
+
+async def catch_up_guild(guild, before):
+    # Queues scans for what was posted in the configured channels while the bot was offline.
+    # Channels without a checkpoint, scanned before checkpoints existed, continue after the
+    # newest message stored for them before the snowflake `before`, taken at on_ready, so live
+    # messages stored since then do not hide the offline gap. Channels that were never scanned
+    # are left to /config.
+    serverLogger = get_server_logger(guild.id)
+    config = load_config(guild.id)
+    checkpoints = get_scan_checkpoints(guild.id)
+    db = await get_server_database_async(guild.id)
+
+    for kind in ('download', 'video'):
+        latest = None
+        for channel_id in config.get(f'{kind}_channels', {}):
+            channel = guild.get_channel(int(channel_id))
+            if channel is None:
+                continue
+
+            if checkpoints.get(kind, channel.id) is None:
+                if latest is None:
+                    latest = await db.aio.get_latest_message_ids(kind, before)
+                if channel.id not in latest:
+                    serverLogger.logger.info(f"Skipped catch-up of {kind} channel {channel.name}, it has not been scanned yet")
+                    continue
+                checkpoints.advance(kind, channel.id, latest[channel.id])
+
+            scan_scheduler.submit(guild.id, kind, channel)
@@ -0,0 +1,78 @@
+# Batched fuzzy scoring. Every scorer takes an already lowercased query and a list of
+# lowercased choices and scores them in one call, returning a numpy array with one score
+# per choice. Scores are rounded to whole numbers like fuzzywuzzy did, so existing
+# percentage cutoffs keep the same meaning. numpy and rapidfuzz are imported on first use,
+# they are most of the bot's import time and nothing needs them before the first search.
+
+# Threads rapidfuzz may use per call, -1 uses every core. Search worker processes lower it to 1.
+WORKERS = -1
+
+def load_dependencies():
+    import numpy
+    import rapidfuzz.process
+    import rapidfuzz.distance.Levenshtein
+
+def _cutoff(percentage):
+    # A raw score of 69.5 rounds up to 70, so it has to pass a 70% cutoff
+    return max(percentage - 0.5, 0)
+
+def _scores(scorer, query, choices, percentage):
+    import numpy as np
+    from rapidfuzz import process
+
+    if not choices:
+        return np.zeros(0, dtype=np.float32)
+    scores = process.cdist([query], choices, scorer=scorer, processor=None, score_cutoff=_cutoff(percentage), workers=WORKERS)[0]
+    return np.rint(scores)
+
+def ratio_scores(query, choices, percentage=0):
+    from rapidfuzz import fuzz
+    return _scores(fuzz.ratio, query, choices, percentage)
+
+def legacy_partial_ratio(query, choice):
+    # fuzzywuzzy's partial_ratio only tries windows aligned to the matching blocks, which can
+    # score lower than rapidfuzz's optimal alignment. This reproduces it exactly.
+    from rapidfuzz import fuzz
+    from rapidfuzz.distance import Levenshtein
+
+    if query == choice:
+        return 100
+    if not query or not choice:
+        return 0
+
+    shorter, longer = (query, choice) if len(query) <= len(choice) else (choice, query)
+    best = 0
+    for block in Levenshtein.opcodes(shorter, longer).as_matching_blocks():
+        start = max(block.b - block.a, 0)
+        score = fuzz.ratio(shorter, longer[start:start + len(shorter)])
+        if score > 99.5:
+            return 100
+        best = max(best, score)
+    return round(best)
+
+def partial_ratio_scores(query, choices, percentage=0):
+    # rapidfuzz's partial_ratio is never lower than the legacy score, so it is used as a batched
+    # prefilter and only the choices that pass it are rescored the legacy way
+    import numpy as np
+    from rapidfuzz import fuzz
+
+    scores = _scores(fuzz.partial_ratio, query, choices, percentage)
+    for index in np.flatnonzero(scores >= percentage).tolist():
+        scores[index] = legacy_partial_ratio(query, choices[index])
+    return scores
+
+SCORERS = {
+    'ratio': ratio_scores,
+    'partial_ratio': partial_ratio_scores,
+}
+
+def substring_mask(query, choices):
+    import numpy as np
+    return np.fromiter((query in choice for choice in choices), dtype=bool, count=len(choices))
+
+def rank(scores, percentage, count):
+    # Positions of the best scores at or above the cutoff, highest first, ties in insertion order
+    import numpy as np
+    matched = np.flatnonzero(scores >= percentage)
+    order = np.argsort(-scores[matched], kind='stable')
+    return matched[order][:count].tolist()
@@ -0,0 +1,106 @@
+import sys
+import threading
+
+from core import search
+
+# Optional process pool for fuzzy scoring on big guilds. A search column (the lowercased
+# names or IDs of one guild at one generation) is published once into a shared memory
+# block, workers attach to it by name and keep the decoded column until the guild's
+# generation moves on, so a query only sends the block name and the query string.
+# multiprocessing is only imported once the pool is used.
+
+SEPARATOR = '\x1f'
+
+class SharedColumn:
+    def __init__(self, key, generation, values):
+        from multiprocessing import shared_memory
+
+        data = SEPARATOR.join(value.replace(SEPARATOR, ' ') for value in values).encode('utf-8')
+        self.key = key
+        self.generation = generation
+        self.count = len(values)
+        self.size = len(data)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        self.shm.buf[:self.size] = data
+
+    def task(self):
+        return (self.key, self.generation, self.shm.name, self.size, self.count)
+
+    def release(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+# Worker side: column key -> (generation, values)
+_columns = {}
+
+def _init_worker():
+    # Every worker scores on one core, the pool itself provides the parallelism
+    search.WORKERS = 1
+
+def _attach(key, generation, name, size, count):
+    from multiprocessing import shared_memory
+
+    cached = _columns.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    values = data.decode('utf-8').split(SEPARATOR) if count else []
+    _columns[key] = (generation, values)
+    return values
+
+def _score(column, scorer, query, percentage):
+    values = _attach(*column)
+    return search.SCORERS[scorer](query, values, percentage)
+
+class SearchPool:
+    def __init__(self, processes, min_rows):
+        self.processes = processes
+        self.min_rows = min_rows
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def enabled_for(self, count):
+        return self.processes > 0 and count >= self.min_rows
+
+    def _get_executor(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                # spawn, since the bot process already runs threads when the pool starts
+                context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=context, initializer=_init_worker)
+            return self._executor
+
+    def score(self, column, scorer, query, percentage):
+        # None when the pool could not score, the caller then scores in process
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            return self._get_executor().submit(_score, column.task(), scorer, query, percentage).result()
+        except FileNotFoundError:
+            # The column was released for a newer generation while the query was queued
+            return None
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            return None
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
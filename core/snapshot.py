@@ -0,0 +1,141 @@
+import struct
+import sys
+from array import array
+
+from core.catalog import JUMP_URL_FORMAT, PACKED_LINK, CatalogTable, encode_links, normalize_links
+from core.journal import write_atomic
+
+# Binary snapshot of a catalog table. The file is a header followed by sections, each one
+# a little endian u64 byte length, the payload and padding up to 8 bytes:
+#
+#   text column:  u64 character offsets (rows + 1), then the column's values as one UTF-8 blob
+#   links column: u32 link count per row, then 16 bytes of channel/message IDs per link,
+#                 the same packing as CatalogTable uses in memory
+#
+# Sections are aligned, so fixed width arrays are used straight from the file buffer (or a
+# memory map of it) and every text column is read with a single decode, instead of parsing
+# CSV and JSON row by row.
+#
+# Version 1 files stored the links as channel names and jump URLs, they are still read and
+# converted.
+
+MAGIC = b'DDRSNAP2'
+MAGIC_V1 = b'DDRSNAP1'
+HEADER = struct.Struct('<8sQ')
+LENGTH = struct.Struct('<Q')
+V1_PACKED_IDS = struct.Struct('<QQQ')
+V1_PACKED_LINK = 0
+
+def _array_bytes(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+def _text_sections(values):
+    offsets = [0]
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return [_array_bytes('Q', offsets), ''.join(values).encode('utf-8')]
+
+def _links_sections(rows):
+    return [_array_bytes('I', [len(links) // PACKED_LINK.size for links in rows]), b''.join(rows)]
+
+def write_snapshot(file_path, table):
+    sections = []
+    for column in table.columns:
+        values = table.column(column)
+        sections.extend(_links_sections(values) if column == 'links' else _text_sections(values))
+
+    def write(f):
+        f.write(HEADER.pack(MAGIC, len(table)))
+        for section in sections:
+            f.write(LENGTH.pack(len(section)))
+            f.write(section)
+            f.write(b'\0' * (-len(section) % 8))
+
+    write_atomic(file_path, write, binary=True)
+
+class _Reader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = HEADER.size
+
+    def section(self):
+        length, = LENGTH.unpack_from(self.buffer, self.position)
+        start = self.position + LENGTH.size
+        self.position = start + length + (-length % 8)
+        return self.buffer[start:start + length]
+
+    def array(self, typecode):
+        section = self.section()
+        if sys.byteorder == 'little':
+            return section.cast(typecode)
+        values = array(typecode, section.tobytes())
+        values.byteswap()
+        return values
+
+    def text(self):
+        offsets = self.array('Q')
+        text = str(self.section(), 'utf-8')
+        return [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    def links(self):
+        counts = self.array('I')
+        packed = self.section()
+
+        rows = []
+        start = 0
+        for count in counts:
+            end = start + count * PACKED_LINK.size
+            rows.append(bytes(packed[start:end]))
+            start = end
+        if start != len(packed):
+            raise IndexError('link section size does not match the link counts')
+        return rows
+
+    def links_v1(self):
+        counts = self.array('I')
+        self.text()
+        self.array('I')
+        kinds = self.array('B')
+        packed = self.section()
+        texts = self.text()
+
+        rows = []
+        link = packed_link = text_link = 0
+        for count in counts:
+            links = {}
+            for _ in range(count):
+                if kinds[link] == V1_PACKED_LINK:
+                    url = JUMP_URL_FORMAT.format(*V1_PACKED_IDS.unpack_from(packed, packed_link * V1_PACKED_IDS.size))
+                    packed_link += 1
+                else:
+                    url = texts[text_link]
+                    text_link += 1
+                links[str(link)] = url
+                link += 1
+            rows.append(encode_links(normalize_links(links)))
+        return rows
+
+def read_snapshot(file_path, columns):
+    # Returns the table and whether the file was in an older format
+    with open(file_path, 'rb') as f:
+        buffer = memoryview(f.read())
+
+    if len(buffer) < HEADER.size:
+        raise ValueError(f'{file_path} is not a database snapshot')
+    magic, rows = HEADER.unpack_from(buffer)
+    if magic not in (MAGIC, MAGIC_V1):
+        raise ValueError(f'{file_path} is not a database snapshot')
+
+    reader = _Reader(buffer)
+    read_links = reader.links if magic == MAGIC else reader.links_v1
+    try:
+        data = {column: read_links() if column == 'links' else reader.text() for column in columns}
+    except (struct.error, TypeError, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f'{file_path} is damaged: {e}') from None
+
+    if any(len(values) != rows for values in data.values()):
+        raise ValueError(f'{file_path} is damaged')
+    return CatalogTable(columns, data), magic != MAGIC
@@ -0,0 +1,333 @@
+import csv
+import json
+import os
+import threading
+
+from core.catalog import CatalogTable, is_legacy_links, normalize_links
+from core.journal import Journal, write_atomic
+from core.snapshot import read_snapshot, write_snapshot
+
+# Table name -> (key column, columns). An upserted row with 'deleted': True removes the entry
+# with its key.
+TABLES = {
+    'download': ('id', ['id', 'name', 'links']),
+    'video': ('name', ['name', 'tag', 'links']),
+}
+
+# Number of journaled upserts after which the journal is folded into the CSV snapshot
+COMPACT_THRESHOLD = 1000
+
+def _merge_row(rows, key, record):
+    if record.get('deleted'):
+        rows.pop(record[key], None)
+        return
+    # Journals written before full rows were stored only hold the changed channel link
+    if 'links' not in record:
+        existing = rows.get(record[key], {})
+        record = {**existing, **record, 'links': {**existing.get('links', {}), record['channel']: record['link']}}
+        record.pop('channel', None)
+        record.pop('link', None)
+    rows[record[key]] = {**record, 'links': normalize_links(record['links'])}
+
+def _modified(paths):
+    # Newest modification time of the files that exist, 0 when none does
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0)
+
+def _table_files(server_dir, table, snapshot_name, journal_name):
+    journal = os.path.join(server_dir, journal_name.format(table=table))
+    return [os.path.join(server_dir, snapshot_name.format(table=table)), journal, journal + '.old']
+
+class CsvStorage:
+    # Every backend has its own journal, so one backend never replays or clears the other's records
+    SNAPSHOT_NAME = '{table}_database.csv'
+    JOURNAL_NAME = '{table}_database.journal'
+
+    def __init__(self, server_dir, logger):
+        self.server_dir = server_dir
+        self.logger = logger
+        self.files = {table: os.path.join(server_dir, CsvStorage.SNAPSHOT_NAME.format(table=table)) for table in TABLES}
+        self.journals = {table: Journal(os.path.join(server_dir, self.JOURNAL_NAME.format(table=table))) for table in TABLES}
+        self._compactions = {}
+
+    def load(self, table):
+        key, columns = TABLES[table]
+        rows = {}
+        legacy = 0
+
+        file_path = self.files[table]
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    row = {column: row.get(column, '') for column in columns}
+                    links = json.loads(row['links']) if row['links'] else {}
+                    if is_legacy_links(links):
+                        legacy += 1
+                    row['links'] = normalize_links(links)
+                    # Keep the first occurrence of a duplicated key
+                    rows.setdefault(row[key], row)
+
+        journal = self.journals[table]
+        records = journal.replay()
+        for record in records:
+            _merge_row(rows, key, record)
+
+        if records or legacy:
+            # Fold the replayed records into the snapshot right away so the journal starts empty
+            self._write_snapshot(table, rows.values())
+            journal.clear()
+            if records:
+                self.logger.info(f"Replayed {len(records)} journal records into {os.path.basename(file_path)}")
+            if legacy:
+                self.logger.info(f"Converted the links of {legacy} entries in {os.path.basename(file_path)} to channel and message IDs")
+
+        return list(rows.values())
+
+    def load_table(self, table):
+        # The binary backend does not update the CSV files, loading them after it wrote newer
+        # data would hide that data and let the next compaction overwrite it
+        binary_files = _table_files(self.server_dir, table, BinaryStorage.SNAPSHOT_NAME, BinaryStorage.JOURNAL_NAME)
+        csv_files = _table_files(self.server_dir, table, CsvStorage.SNAPSHOT_NAME, CsvStorage.JOURNAL_NAME)
+        if _modified(binary_files) > _modified(csv_files):
+            raise RuntimeError(
+                f"{os.path.basename(binary_files[0])} holds newer data than {os.path.basename(csv_files[0])}, "
+                f"run `python tools/convert_database.py export` before switching to the CSV backend"
+            )
+        return CatalogTable.from_rows(TABLES[table][1], self.load(table))
+
+    def upsert(self, table, row):
+        self.journals[table].append(row)
+
+    def upsert_many(self, table, rows):
+        self.journals[table].append_many(rows)
+
+    def needs_compaction(self, table):
+        # Not while the last compaction of the table is still being written, so callers do not
+        # copy the table for nothing. The records since then count toward the next one.
+        return self.journals[table].record_count >= COMPACT_THRESHOLD and not self._compacting(table)
+
+    def _compacting(self, table):
+        running = self._compactions.get(table)
+        return running is not None and running.is_alive()
+
+    def compact(self, table, rows):
+        # rows is a copy of the table that is not changed anymore, it is written on the compaction thread
+        if self._compacting(table):
+            return
+
+        journal = self.journals[table]
+        journal.rotate()
+
+        def run():
+            try:
+                self._write_table(table, rows)
+                journal.discard_old()
+            except Exception as e:
+                self.logger.error(f"Compaction of {os.path.basename(self.files[table])} failed: {e}")
+
+        thread = threading.Thread(target=run, name=f'compact-{table}', daemon=False)
+        self._compactions[table] = thread
+        thread.start()
+
+    def close(self):
+        for thread in self._compactions.values():
+            thread.join()
+        for journal in self.journals.values():
+            journal.close()
+
+    def _write_table(self, table, rows):
+        self._write_snapshot(table, rows.records(range(len(rows))))
+
+    def _write_snapshot(self, table, rows):
+        columns = TABLES[table][1]
+
+        def write(f):
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({**row, 'links': json.dumps(row['links'])})
+
+        write_atomic(self.files[table], write)
+
+class BinaryStorage(CsvStorage):
+    # Binary snapshots (see core/snapshot.py) with a journal like the CSV backend's. The CSV
+    # files are only read once, when a server is first opened with this backend, and can be
+    # written again with tools/convert_database.py.
+    SNAPSHOT_NAME = '{table}_database.bin'
+    JOURNAL_NAME = '{table}_database.bin.journal'
+
+    def __init__(self, server_dir, logger):
+        super().__init__(server_dir, logger)
+        self.snapshot_files = {table: os.path.join(server_dir, self.SNAPSHOT_NAME.format(table=table)) for table in TABLES}
+        for table in TABLES:
+            self._adopt_shared_journal(table)
+
+    def _adopt_shared_journal(self, table):
+        # This backend used to write to the CSV journal. When its snapshot is newer than the CSV
+        # file, the records there are its own and move to its journal.
+        journal = self.journals[table]
+        shared = Journal(os.path.join(self.server_dir, CsvStorage.JOURNAL_NAME.format(table=table)))
+        if os.path.exists(journal.path) or os.path.exists(journal.old_path) or not os.path.exists(self.snapshot_files[table]):
+            return
+        if _modified([self.snapshot_files[table]]) <= _modified([self.files[table]]):
+            return
+        for source, target in ((shared.old_path, journal.old_path), (shared.path, journal.path)):
+            if os.path.exists(source):
+                os.replace(source, target)
+                self.logger.info(f"Moved {os.path.basename(source)} to {os.path.basename(target)}")
+
+    def load(self, table):
+        table_rows = self.load_table(table)
+        return table_rows.records(range(len(table_rows)))
+
+    def load_table(self, table):
+        key, columns = TABLES[table]
+        file_path = self.snapshot_files[table]
+
+        if not os.path.exists(file_path):
+            # Importing through the CSV backend also folds in its journal
+            csv_storage = CsvStorage(self.server_dir, self.logger)
+            rows = CatalogTable.from_rows(columns, csv_storage.load(table))
+            csv_storage.close()
+            write_snapshot(file_path, rows)
+            if len(rows):
+                self.logger.info(f"Imported {len(rows)} {table} entries from CSV into {os.path.basename(file_path)}")
+            outdated = False
+        else:
+            rows, outdated = read_snapshot(file_path, columns)
+
+        journal = self.journals[table]
+        records = journal.replay()
+        if records:
+            index = {}
+            for row, value in enumerate(rows.column(key)):
+                index.setdefault(value, row)
+            deleted = False
+            for record in records:
+                row = index.get(record[key])
+                if record.get('deleted'):
+                    if row is not None:
+                        rows.delete(row)
+                        del index[record[key]]
+                        deleted = True
+                    continue
+                record = {**record, 'links': normalize_links(record['links'])}
+                if row is None:
+                    index[record[key]] = rows.append(record)
+                else:
+                    for column in columns:
+                        rows.set(row, column, record[column])
+            if deleted:
+                rows = rows.copy(key)
+
+        if records or outdated:
+            write_snapshot(file_path, rows)
+            journal.clear()
+            if records:
+                self.logger.info(f"Replayed {len(records)} journal records into {os.path.basename(file_path)}")
+            if outdated:
+                self.logger.info(f"Converted {os.path.basename(file_path)} to the current snapshot format")
+
+        return rows
+
+    def _write_table(self, table, rows):
+        write_snapshot(self.snapshot_files[table], rows)
+
+class SqliteStorage:
+    def __init__(self, server_dir, logger):
+        import sqlite3
+
+        self.server_dir = server_dir
+        self.logger = logger
+        self.db_file = os.path.join(server_dir, 'database.sqlite3')
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS download (id TEXT NOT NULL UNIQUE, name TEXT NOT NULL, links TEXT NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS download_name ON download (name)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS video (name TEXT NOT NULL UNIQUE, tag TEXT NOT NULL, links TEXT NOT NULL)')
+
+        # user_version 0 means the existing data has not been imported yet
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+            self.migrate()
+
+    def migrate(self):
+        # From the binary snapshots when there are any, they are newer than the CSV files they
+        # were imported from. Either way the source's journal is folded in first.
+        binary = any(os.path.exists(path) for table in TABLES for path in _table_files(self.server_dir, table, BinaryStorage.SNAPSHOT_NAME, BinaryStorage.JOURNAL_NAME))
+        source = (BinaryStorage if binary else CsvStorage)(self.server_dir, self.logger)
+        tables = {table: source.load(table) for table in TABLES}
+        source.close()
+
+        # One transaction, so a crash halfway leaves user_version at 0 and the import is redone
+        with self._lock, self.conn:
+            for table, rows in tables.items():
+                self._upsert_rows(table, rows)
+            self.conn.execute('PRAGMA user_version = 1')
+
+        for table, rows in tables.items():
+            if rows:
+                self.logger.info(f"Migrated {len(rows)} {table} entries from {'binary snapshots' if binary else 'CSV'} to SQLite")
+
+    def load(self, table):
+        columns = TABLES[table][1]
+        with self._lock:
+            cursor = self.conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+            rows = [dict(zip(columns, values)) for values in cursor]
+
+        legacy = []
+        for row in rows:
+            links = json.loads(row['links'])
+            row['links'] = normalize_links(links)
+            if is_legacy_links(links):
+                legacy.append(row)
+        if legacy:
+            self.upsert_many(table, legacy)
+            self.logger.info(f"Converted the links of {len(legacy)} {table} entries to channel and message IDs")
+        return rows
+
+    def load_table(self, table):
+        return CatalogTable.from_rows(TABLES[table][1], self.load(table))
+
+    def upsert(self, table, row):
+        self.upsert_many(table, [row])
+
+    def upsert_many(self, table, rows):
+        with self._lock, self.conn:
+            self._upsert_rows(table, rows)
+
+    def _upsert_rows(self, table, rows):
+        key, columns = TABLES[table]
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != key)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({key}) DO UPDATE SET {updates}"
+        )
+        values = [[json.dumps(row[column]) if column == 'links' else row[column] for column in columns] for row in rows if not row.get('deleted')]
+        self.conn.executemany(sql, values)
+        deleted = [(row[key],) for row in rows if row.get('deleted')]
+        if deleted:
+            self.conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", deleted)
+
+    def needs_compaction(self, table):
+        return False
+
+    def compact(self, table, rows):
+        pass
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+STORAGE_BACKENDS = {
+    'csv': CsvStorage,
+    'binary': BinaryStorage,
+    'sqlite': SqliteStorage,
+}
+
+def open_storage(backend, server_dir, logger):
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}', expected one of: {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend](server_dir, logger)
@@ -0,0 +1,86 @@
+import asyncio
+import discord
+
+from core.config import TITLE_FALLBACK_DELAY
+from core.database import get_server_database_async
+from core.logger import get_server_logger
+
+# Titles of new posts that Discord had not added the embed to yet. The post is stored under a
+# placeholder right away and completed when the embed arrives with the message edit, or by a
+# single fetch after TITLE_FALLBACK_DELAY seconds when no edit came.
+
+# Names the entry keeps when the post never gets a title, the same as before placeholders
+UNKNOWN_TITLES = {'download': "Unknown Title", 'video': "Unknown Video Title"}
+
+class PendingTitle:
+    __slots__ = ('server_id', 'kind', 'key', 'tag', 'channel', 'message_id', 'fallback')
+
+    def __init__(self, message, kind, key, tag):
+        self.server_id = message.guild.id
+        self.kind = kind
+        # The download ID or the placeholder name of the video entry
+        self.key = key
+        self.tag = tag
+        self.channel = message.channel
+        self.message_id = message.id
+        self.fallback = None
+
+class PendingTitles:
+    def __init__(self):
+        # message ID -> PendingTitle
+        self.pending = {}
+
+    def add(self, message, kind, key, tag=None):
+        pending = PendingTitle(message, kind, key, tag)
+        self.pending[message.id] = pending
+        pending.fallback = asyncio.create_task(self._fallback(pending))
+
+    async def on_edit(self, message_id, data):
+        # Called for every raw message edit, only a dict lookup unless the message is waiting for its title
+        pending = self.pending.get(message_id)
+        if pending is None:
+            return
+        title = _title_from_data(data)
+        if title:
+            pending.fallback.cancel()
+            self.pending.pop(message_id, None)
+            await self._complete(pending, title)
+
+    def discard(self, message_id):
+        # The message was deleted before its title came
+        pending = self.pending.pop(message_id, None)
+        if pending is not None:
+            pending.fallback.cancel()
+
+    async def _fallback(self, pending):
+        await asyncio.sleep(TITLE_FALLBACK_DELAY)
+        if self.pending.pop(pending.message_id, None) is None:
+            return
+
+        title = None
+        try:
+            message = await pending.channel.fetch_message(pending.message_id)
+            if message.embeds and message.embeds[0].title:
+                title = message.embeds[0].title
+        except discord.HTTPException:
+            pass
+        await self._complete(pending, title)
+
+    async def _complete(self, pending, title):
+        try:
+            db = await get_server_database_async(pending.server_id)
+            if pending.kind == 'download':
+                if title:
+                    await db.aio.update_download_database(pending.key, title, pending.channel.id, pending.message_id)
+            else:
+                await db.aio.rename_video(pending.key, title or UNKNOWN_TITLES['video'], pending.channel.id, pending.message_id, pending.tag)
+        except Exception as e:
+            get_server_logger(pending.server_id).logger.error(f"Completing the title of message {pending.message_id} failed: {e}")
+
+def _title_from_data(data):
+    embeds = data.get('embeds') or []
+    if embeds and embeds[0].get('title'):
+        return embeds[0]['title']
+    return None
+
+pending_titles = PendingTitles()
@@ -1,178 +1,284 @@
-import re
+import time
 import asyncio
 import discord
 
-from core.database import get_server_database
+from core.checkpoints import get_scan_checkpoints, held_channels
+from core.database import get_server_database_async, run_in_db_pool
 from core.logger import get_server_logger
-from core.config import load_config
+from core.matcher import (
+    DOWNLOAD_LINK, DOWNLOAD_LINK_LITERAL, YOUTUBE_LINK, YOUTUBE_LITERAL, ROLE_TAG, ROLE_TAG_LITERAL, get_download_matcher,
+)
+from core.titles import UNKNOWN_TITLES, pending_titles
+from core.config import SCAN_BATCH_SIZE, SCAN_PARSE_WORKERS, load_policy
+
+# Messages per history request, the most Discord returns at once
+SCAN_PAGE_SIZE = 100
 
 def truncate_with_dots(text, max_length=256):
     if len(text) > max_length:
         return text[: max_length - 3] + "..."
     return text
     
-async def process_download_message(message):
-    server_id = message.guild.id
-    config = load_config(server_id)
-    search_regex = config.get('search_regex', 'DN : (.+)')
-
-    content_to_check = message.content
-
-    # Check for embeds
-    if message.embeds:
+def parse_download_message(message, matcher):
+    # (id, title) of a download post, title is None while Discord has not added the embed yet.
+    # The content and the embed descriptions are searched one after the other, matcher is the
+    # guild's DownloadMatcher (see core/matcher.py).
+    literal = matcher.literal
+    match = None
+    if literal is None or literal in message.content:
+        match = matcher.pattern.search(message.content)
+    if match is None:
         for embed in message.embeds:
-            if embed.description:
-                content_to_check += "\n" + embed.description
-
-    match = re.search(search_regex, content_to_check)
-    if match:
-        id = match.group(1)
-        download_match = re.search(r'Link : (https?://\S+)', content_to_check)
-        if download_match:
-            name = await get_title_from_embed(message)
-
-            if not name:
-                name = "Unknown Title"
+            description = embed.description
+            if description and (literal is None or literal in description):
+                match = matcher.pattern.search(description)
+                if match:
+                    break
+        if match is None:
+            return None
 
-            server_id = message.guild.id
-            db = get_server_database(server_id)
-            db.update_download_database(id, name, message.channel.name, message.jump_url)
+    if DOWNLOAD_LINK_LITERAL in message.content and DOWNLOAD_LINK.search(message.content):
+        return match.group(1), embed_title(message)
+    for embed in message.embeds:
+        description = embed.description
+        if description and DOWNLOAD_LINK_LITERAL in description and DOWNLOAD_LINK.search(description):
+            return match.group(1), embed_title(message)
+    return None
 
-async def process_video_message(message):
-    content_to_check = message.content
+def parse_video_message(message):
+    # (title, tag, url) of a video post, title is None while Discord has not added the embed yet
+    parts = [message.content]
     video_url = None
     video_title = None
 
-    if message.embeds:
-        for embed in message.embeds:
-            if embed.type == 'video' and embed.url:
-                video_url = embed.url
-                video_title = embed.title
-            elif embed.type == 'rich' and embed.url and ('youtube.com' in embed.url or 'youtu.be' in embed.url):
-                video_url = embed.url
-                video_title = embed.title
-            
-            if embed.description:
-                content_to_check += "\n" + embed.description
-            if embed.fields:
-                for field in embed.fields:
-                    content_to_check += f"\n{field.name}: {field.value}"
-            
-            if video_url and video_title:
-                break
+    for embed in message.embeds:
+        if embed.type == 'video' and embed.url:
+            video_url = embed.url
+            video_title = embed.title
+        elif embed.type == 'rich' and embed.url and ('youtube.com' in embed.url or 'youtu.be' in embed.url):
+            video_url = embed.url
+            video_title = embed.title
+
+        if embed.description:
+            parts.append(embed.description)
+        for field in embed.fields:
+            parts.append(f"{field.name}: {field.value}")
+
+        if video_url and video_title:
+            break
 
     if not video_url:
-        youtube_link = re.search(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})', content_to_check)
-        if youtube_link:
-            video_id = youtube_link.group(6)
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-
-    tag_match = re.search(r'<@&(\d+)>', content_to_check)
-    tag = tag_match.group(0) if tag_match else ""
-
-    if video_url:
-        name = video_title if video_title else await get_title_from_embed(message)
-        if not name:
-            name = "Unknown Video Title"
-
-        server_id = message.guild.id
-        db = get_server_database(server_id)
-        db.update_video_database(name, message.channel.name, message.jump_url, tag)
-
-async def get_title_from_embed(message):
-    max_attempts = 10
-    delay = 1
-
-    for _ in range(max_attempts):
-        if message.embeds:
-            embed = message.embeds[0]
-            if embed.title:
-                return embed.title
-        
-        await asyncio.sleep(delay)
-        try:
-            message = await message.channel.fetch_message(message.id)
-        except discord.errors.NotFound:
+        for part in parts:
+            if YOUTUBE_LITERAL in part:
+                youtube_link = YOUTUBE_LINK.search(part)
+                if youtube_link:
+                    video_url = f"https://www.youtube.com/watch?v={youtube_link.group(6)}"
+                    break
+        if not video_url:
             return None
 
+    tag = ""
+    for part in parts:
+        if ROLE_TAG_LITERAL in part:
+            tag_match = ROLE_TAG.search(part)
+            if tag_match:
+                tag = tag_match.group(0)
+                break
+
+    return video_title or embed_title(message), tag, video_url
+
+def embed_title(message):
+    if message.embeds and message.embeds[0].title:
+        return message.embeds[0].title
     return None
 
-async def scan_download_channel(ctx, channel, server_id=None):
-    if server_id is None:
-        if ctx and ctx.guild:
-            server_id = ctx.guild.id
-        else:
-            raise ValueError("server_id must be provided if not available in ctx")
+class EditedMessage:
+    # The parts of an edited message the parse functions read, from the data of a raw edit event
+    __slots__ = ('id', 'content', 'embeds')
 
-    serverLogger = get_server_logger(server_id)
-    
-    try:
-        message_count = 0
-        async for message in channel.history(limit=None):
-            await process_download_message(message)
-            message_count += 1
-            
-            if message_count % 100 == 0:
-                await asyncio.sleep(0)
-
-        result_message = f"✅ Scan finished for channel: **{channel.name}**. Processed **{message_count}** messages."
-        serverLogger.logger.info(result_message)
-        
-        if ctx:
-            if ctx.interaction.response.is_done():
-                await ctx.followup.send(result_message, ephemeral=True)
-            else:
-                await ctx.respond(result_message, ephemeral=True)
+    def __init__(self, message_id, data):
+        self.id = message_id
+        self.content = data.get('content') or ''
+        self.embeds = [discord.Embed.from_dict(embed) for embed in data.get('embeds') or []]
+
+async def process_download_edit(server_id, channel_id, message):
+    # Updates the entry of an edited download post in place, using the database's message index
+    parsed = parse_download_message(message, get_download_matcher(server_id))
+    db = await get_server_database_async(server_id)
+    entry = await db.aio.get_message_entry('download', message.id)
+    if not parsed:
+        # No longer a download post
+        if entry:
+            await db.aio.remove_messages('download', [message.id])
+        return
+
+    id, name = parsed
+    same_id = entry is not None and entry['id'] == id.upper()
+    if same_id and (name is None or name == entry['name']):
+        return
+    if name is None:
+        name = entry['name'] if same_id else UNKNOWN_TITLES['download']
+    await db.aio.move_download_message(id, name, channel_id, message.id)
+
+async def process_video_edit(server_id, channel_id, message):
+    parsed = parse_video_message(message)
+    db = await get_server_database_async(server_id)
+    entry = await db.aio.get_message_entry('video', message.id)
+    if not parsed:
+        if entry:
+            await db.aio.remove_messages('video', [message.id])
+        return
+
+    name, tag, _ = parsed
+    if entry is None:
+        await db.aio.update_video_database(name or UNKNOWN_TITLES['video'], channel_id, message.id, tag)
+        return
+    name = name or entry['name']
+    if name != entry['name'] or tag != entry['tag']:
+        await db.aio.rename_video(entry['name'], name, channel_id, message.id, tag)
+
+async def remove_deleted_messages(server_id, channel_id, message_ids):
+    for message_id in message_ids:
+        pending_titles.discard(message_id)
+
+    policy = load_policy(server_id)
+    kinds = [kind for kind, channels in (('download', policy.download_channels), ('video', policy.video_channels)) if channel_id in channels]
+    if not kinds:
+        return
+    db = await get_server_database_async(server_id)
+    for kind in kinds:
+        await db.aio.remove_messages(kind, list(message_ids))
+
+def _parse_scan_page(kind, messages, matcher):
+    # Runs on the database pool. Old posts have their embeds already, so a missing title is
+    # not waited for like in on_message.
+    entries = []
+    for message in messages:
+        if kind == 'download':
+            parsed = parse_download_message(message, matcher)
+            if parsed:
+                id, name = parsed
+                entries.append((id, name or UNKNOWN_TITLES['download'], message.channel.id, message.id))
         else:
-            print(f"✅ Scan finished for channel: {channel.name}. Processed {message_count} messages.")
-    except Exception as e:
-        error_message = f"❌ **An error occurred** while scanning {channel.name}: {str(e)}"
-        serverLogger.logger.error(error_message)
-
-        if ctx:
-            if ctx.interaction.response.is_done():
-                await ctx.followup.send(error_message, ephemeral=True)
+            parsed = parse_video_message(message)
+            if parsed:
+                name, tag, _ = parsed
+                entries.append((name or UNKNOWN_TITLES['video'], message.channel.id, message.id, tag))
+    return entries
+
+async def scan_channel_history(server_id, kind, channel, pacer=None, progress=None):
+    # Scan pipeline: the producer streams history pages oldest first, starting after the
+    # channel's checkpoint, SCAN_PARSE_WORKERS parsers extract entries from the pages on the
+    # database pool, and the store stage puts the pages back in order and writes them to the
+    # database every SCAN_BATCH_SIZE messages. The checkpoint moves after every stored batch,
+    # so an interrupted scan resumes where it stopped.
+    # pacer spaces out the history requests (see core/scan_jobs.py) and progress is awaited
+    # with the number of messages stored so far after every batch.
+    # Returns (messages processed, whether it resumed from a checkpoint, seconds taken).
+    started_at = time.perf_counter()
+    matcher = get_download_matcher(server_id)
+    db = await get_server_database_async(server_id)
+    update_entries = db.aio.update_download_entries if kind == 'download' else db.aio.update_video_entries
+
+    checkpoints = get_scan_checkpoints(server_id)
+    after = checkpoints.get(kind, channel.id)
+    held_channels.add((server_id, kind, channel.id))
+
+    # Bounded, so the producer waits for slow parsers instead of buffering the whole channel
+    pages = asyncio.Queue(SCAN_PARSE_WORKERS * 2)
+    parsed_pages = asyncio.Queue(SCAN_PARSE_WORKERS * 2)
+    message_count = 0
+
+    fetch_error = None
+
+    async def produce():
+        nonlocal fetch_error
+        sequence = 0
+        page = []
+        history = channel.history(limit=None, after=discord.Object(id=after) if after else None, oldest_first=True).__aiter__()
+        try:
+            while True:
+                # The first message of every page makes the iterator send the next request
+                if not page and pacer is not None:
+                    await pacer.wait()
+                requested_at = time.perf_counter()
+                try:
+                    message = await history.__anext__()
+                except StopAsyncIteration:
+                    break
+                if not page and pacer is not None:
+                    pacer.record(time.perf_counter() - requested_at)
+
+                page.append(message)
+                if len(page) == SCAN_PAGE_SIZE:
+                    await pages.put((sequence, page))
+                    sequence += 1
+                    page = []
+        except Exception as e:
+            # The messages read before the error are still stored, the next scan continues after them
+            fetch_error = e
+        if page:
+            await pages.put((sequence, page))
+        for _ in range(SCAN_PARSE_WORKERS):
+            await pages.put(None)
+
+    async def parse():
+        while (item := await pages.get()) is not None:
+            sequence, page = item
+            entries = await run_in_db_pool(_parse_scan_page, kind, page, matcher)
+            await parsed_pages.put((sequence, entries, len(page), page[-1].id))
+        await parsed_pages.put(None)
+
+    async def store():
+        nonlocal checkpoints, message_count
+        waiting = {}
+        next_sequence = 0
+        batch = []
+        batch_messages = 0
+        last_message_id = None
+        finished = 0
+
+        while finished < SCAN_PARSE_WORKERS:
+            item = await parsed_pages.get()
+            if item is None:
+                finished += 1
             else:
-                await ctx.respond(error_message, ephemeral=True)
-        else:
-            print(f"❌ An error occurred while scanning {channel.name}: {str(e)}")
+                waiting[item[0]] = item
 
-async def scan_video_channel(ctx, channel, server_id=None):
-    if server_id is None:
-        if ctx and ctx.guild:
-            server_id = ctx.guild.id
-        else:
-            raise ValueError("server_id must be provided if not available in ctx")
+            # Pages are stored in message order, a later post of the same entry has to win
+            while next_sequence in waiting:
+                _, entries, page_messages, last_message_id = waiting.pop(next_sequence)
+                next_sequence += 1
+                batch.extend(entries)
+                batch_messages += page_messages
 
-    serverLogger = get_server_logger(server_id)
-    
+            if batch_messages >= SCAN_BATCH_SIZE or (finished == SCAN_PARSE_WORKERS and batch_messages):
+                await update_entries(batch)
+                checkpoints.advance(kind, channel.id, last_message_id)
+                await run_in_db_pool(checkpoints.save)
+                message_count += batch_messages
+                batch = []
+                batch_messages = 0
+                # Fetching it again keeps it from being unloaded as idle during a long scan
+                checkpoints = get_scan_checkpoints(server_id)
+                if progress is not None:
+                    await progress(message_count)
+
+    tasks = [asyncio.create_task(produce()), asyncio.create_task(store())]
+    tasks += [asyncio.create_task(parse()) for _ in range(SCAN_PARSE_WORKERS)]
     try:
-        message_count = 0
-        async for message in channel.history(limit=None):
-            await process_video_message(message)
-            message_count += 1
-            
-            if message_count % 100 == 0:
-                await asyncio.sleep(0)
-
-        result_message = f"✅ Video scan finished for channel: **{channel.name}**. Processed **{message_count}** messages."
-        serverLogger.logger.info(result_message)
-        
-        if ctx:
-            if ctx.interaction.response.is_done():
-                await ctx.followup.send(result_message, ephemeral=True)
-            else:
-                await ctx.respond(result_message, ephemeral=True)
-        else:
-            print(f"✅ Video scan finished for channel: {channel.name}. Processed {message_count} messages.")
-    except Exception as e:
-        error_message = f"❌ **An error occurred** while scanning video channel {channel.name}: {str(e)}"
-        serverLogger.logger.error(error_message)
-
-        if ctx:
-            if ctx.interaction.response.is_done():
-                await ctx.followup.send(error_message, ephemeral=True)
-            else:
-                await ctx.respond(error_message, ephemeral=True)
-        else:
-            print(f"❌ An error occurred while scanning video channel {channel.name}: {str(e)}")
\ No newline at end of file
+        await asyncio.gather(*tasks)
+    finally:
+        # An error in one stage stops the others
+        for task in tasks:
+            task.cancel()
+        held_channels.discard((server_id, kind, channel.id))
+    if fetch_error is not None:
+        raise fetch_error
+
+    elapsed = time.perf_counter() - started_at
+    rate = message_count / elapsed if elapsed else 0
+    get_server_logger(server_id).logger.info(
+        f"Scanned {message_count} messages in {kind} channel {channel.name} in {elapsed:.1f}s ({rate:.0f} msgs/sec)"
+    )
+    return message_count, after is not None, elapsed
@@ -36,10 +36,26 @@ cat << EOF > run_bot_wrapper.sh
 #!/bin/bash
 source "$VENV_PATH/bin/activate"
 
+BOT_PID=""
+
 run_bot() {
-    python bot.py
+    python bot.py &
+    BOT_PID=\$!
+    wait \$BOT_PID
+    BOT_PID=""
+}
+
+# Forward stop signals to the bot so it can flush pending database writes before exiting
+stop_bot() {
+    if [ -n "\$BOT_PID" ]; then
+        kill -TERM \$BOT_PID 2>/dev/null
+        wait \$BOT_PID
+    fi
+    exit 0
 }
 
+trap stop_bot INT TERM HUP
+
 while true; do
     run_bot
     echo "Bot stopped. Waiting 10 seconds before restarting. Press Ctrl+C to exit."
@@ -0,0 +1,28 @@
+import pytest
+
+from core.database import ServerDatabase
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = ServerDatabase(1)
+    db.update_download_entries([
+        ('A1', 'shulker farm', 10, 1),
+        ('A2', 'farm', 10, 2),
+        ('A3', 'poital', 10, 3),
+        ('A4', 'raid', 10, 4),
+        ('A5', 'cccdd', 10, 5),
+    ])
+    yield db
+    db.close()
+
+def names(records):
+    return [record['name'] for record in records]
+
+def test_loose_cutoffs_keep_distant_matches(db):
+    assert 'poital' in names(db.get_matching_downloads(100, 'portl', 70))
+    assert ('A4', 'raid') in db.get_download_id_names(25, 'abcd', 50)
+    assert 'cccdd' in names(db.get_matching_downloads(100, 'ccacd', 80))
+
+def test_exact_name_ranks_first_in_id_name_search(db):
+    assert db.get_download_id_names(1, 'farm', 50) == [('A2', 'farm')]
@@ -0,0 +1,65 @@
+import argparse
+import logging
+import os
+import sys
+
+# Converts server databases between the binary snapshots and CSV. Pending journal records
+# are folded in first, so the output holds everything the bot has stored. Stop the bot first.
+#
+#   python tools/convert_database.py export [server_id ...]   binary -> CSV
+#   python tools/convert_database.py import [server_id ...]   CSV -> binary
+#
+# Without server IDs every server in the data directory is converted.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.catalog import CatalogTable
+from core.snapshot import write_snapshot
+from core.storage import TABLES, BinaryStorage, CsvStorage
+
+DATA_DIR = os.path.join(ROOT, 'data')
+
+def export_csv(server_dir, logger):
+    binary = BinaryStorage(server_dir, logger)
+    for table in TABLES:
+        if not os.path.exists(binary.snapshot_files[table]):
+            continue
+        rows = binary.load_table(table)
+        binary._write_snapshot(table, rows.records(range(len(rows))))
+        logger.info(f'{server_dir}: exported {len(rows)} {table} entries to CSV')
+    binary.close()
+
+def import_csv(server_dir, logger):
+    csv_storage = CsvStorage(server_dir, logger)
+    binary = BinaryStorage(server_dir, logger)
+    for table in TABLES:
+        # Loading through the CSV backend folds its journal into the CSV first. The CSV replaces
+        # the binary snapshot, so the binary journal's records are dropped with it.
+        rows = CatalogTable.from_rows(TABLES[table][1], csv_storage.load(table))
+        write_snapshot(binary.snapshot_files[table], rows)
+        binary.journals[table].clear()
+        logger.info(f'{server_dir}: imported {len(rows)} {table} entries from CSV')
+    csv_storage.close()
+    binary.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert server databases between binary snapshots and CSV')
+    parser.add_argument('direction', choices=['export', 'import'], help='export: binary to CSV, import: CSV to binary')
+    parser.add_argument('server_ids', nargs='*', help='servers to convert, all servers by default')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logger = logging.getLogger('convert_database')
+
+    server_ids = args.server_ids or sorted(name for name in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, name)))
+    convert = export_csv if args.direction == 'export' else import_csv
+    for server_id in server_ids:
+        server_dir = os.path.join(DATA_DIR, server_id)
+        if not os.path.isdir(server_dir):
+            logger.error(f'{server_dir} does not exist')
+            continue
+        convert(server_dir, logger)
+
+if __name__ == '__main__':
+    main()